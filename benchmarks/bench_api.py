@@ -0,0 +1,269 @@
+# bench_api.py - 安全接口压测与加解密微基准
+#
+# 用法（项目根目录）：
+#   python benchmarks/bench_api.py --rows 10000 --requests 2000 --concurrency 50
+#
+# 在临时 SQLite 数据库中写入 N 行数据，以进程内 ASGI 方式启动 server/main.py 的应用
+# （会执行 lifespan，RSA 密钥使用 ./server 下的密钥文件，不存在时自动生成），
+# 预先生成合法的 EncryptedRequest（RSA 包装的 AES 密钥、AES-GCM 数据、HMAC 签名、当前时间戳），
+# 分别压测 /api/secure/verify、/api/secure/verify_batch（每请求 --batch-size 个条目）、
+# /api/secure/token、/api/public_key，输出 p50/p95/p99 延迟与 req/s；
+# 另外单独测量 decrypt_request 与 encrypt_response 的耗时。
+#
+# 服务端的其它开关（CRYPTO_POOL_MODE、VERIFY_CACHE_URI 等）照常从环境变量读取；
+# 加 --lean 时改用精简路由，可与默认路由的结果对比框架开销。
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for path in (project_root, os.path.join(project_root, "server")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="安全接口压测")
+    parser.add_argument("--rows", type=int, default=10_000, help="每张表的行数")
+    parser.add_argument("--requests", type=int, default=2000, help="每个接口的请求数")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发数")
+    parser.add_argument(
+        "--endpoints",
+        default="verify,token,public_key",
+        help="要压测的接口，逗号分隔：verify,verify_batch,token,public_key",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=20, help="verify_batch 每个请求的条目数"
+    )
+    parser.add_argument(
+        "--crypto-iterations", type=int, default=500, help="加解密微基准的迭代次数"
+    )
+    parser.add_argument(
+        "--format",
+        choices=("json", "msgpack"),
+        default="json",
+        help="加密数据的明文格式",
+    )
+    parser.add_argument(
+        "--lean",
+        action="store_true",
+        help="使用精简路由（SECURE_LEAN_ROUTES），与默认的 FastAPI 路由对比",
+    )
+    parser.add_argument("--log", action="store_true", help="保留服务端日志输出")
+    return parser.parse_args()
+
+
+def summarize(
+    name: str, latencies: List[float], elapsed: float, errors: Optional[int] = None
+):
+    q = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<24}{len(latencies) / elapsed:>10.0f}"
+        f"{q[49]:>10.3f}{q[94]:>10.3f}{q[98]:>10.3f}"
+        + (f"{errors:>8}" if errors is not None else "")
+    )
+
+
+async def run_load(
+    http, path: str, bodies: List[tuple[Any, Any]], concurrency: int, check: Callable
+):
+    """bodies: [(请求体, 校验上下文)]，check(response, 校验上下文) 返回是否成功"""
+    latencies: List[float] = []
+    errors = 0
+    queue = iter(bodies)
+
+    async def worker():
+        nonlocal errors
+        for body, context in queue:
+            start = time.perf_counter()
+            response = await http.post(path, json=body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if not check(response, context):
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, errors
+
+
+def bench_crypto(rsa_manager, secure_client, iterations: int, fmt: str):
+    from codec import dump_response, load_request
+    from RSAKeyManager import decrypt_payload, encrypt_payload, validate_request
+    from webmodel import EncryptedRequest, SecureVerifyRequest, VerifyResponse
+
+    requests = [
+        EncryptedRequest(
+            **secure_client.encrypt_request({"device_id": "device"}, fmt=fmt)[0]
+        )
+        for _ in range(iterations)
+    ]
+    latencies = []
+    start = time.perf_counter()
+    for request in requests:
+        t = time.perf_counter()
+        validate_request(request)
+        plaintext, aes_key = decrypt_payload(request, rsa_manager)
+        load_request(SecureVerifyRequest, plaintext, fmt)
+        latencies.append((time.perf_counter() - t) * 1000)
+    summarize("decrypt_request", latencies, time.perf_counter() - start)
+
+    response = VerifyResponse(
+        status=101, message="@user 欢迎使用!", data={"user": "@user"}
+    )
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        encrypt_payload(dump_response(response, fmt), aes_key)
+        latencies.append((time.perf_counter() - t) * 1000)
+    summarize("encrypt_response", latencies, time.perf_counter() - start)
+
+
+async def main(args):
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_api.db")
+    os.environ["DATABASE_URI"] = f"sqlite+aiosqlite:///{db_path}"
+    if args.lean:
+        os.environ["SECURE_LEAN_ROUTES"] = "true"
+
+    import httpx
+
+    import main as server
+    from client import SecureClient
+    from fixture import alipay_id, device_id, seed, token
+    from log import logger
+    from shared.database import ensure_schema, get_global_engine
+
+    if not args.log:
+        logger.remove()
+        logger.add(sys.stderr, level="ERROR")
+
+    await ensure_schema()
+    print(f"写入数据：每张表 {args.rows} 行 -> {db_path}")
+    await seed(get_global_engine(), args.rows)
+
+    endpoints = args.endpoints.split(",")
+    transport = httpx.ASGITransport(app=server.app)
+    async with (
+        server.app.router.lifespan_context(server.app),
+        httpx.AsyncClient(transport=transport, base_url="http://bench") as http,
+    ):
+        public_key = (await http.post("/api/public_key")).json()["public_key"]
+        secure_client = SecureClient(public_key)
+
+        def secure_check(response, aes_key: bytes) -> bool:
+            if response.status_code != 200:
+                return False
+            result = secure_client.decrypt_response(
+                response.json(), aes_key, args.format
+            )
+            # 批量验证还需逐条成功
+            return result["status"] < 200 and all(
+                item["status"] < 200 for item in result.get("results", ())
+            )
+
+        def make_bodies(build: Callable[[int], Dict[str, Any]]):
+            # 请求在计时前生成，客户端侧的 RSA 加密不计入服务端延迟
+            return [
+                secure_client.encrypt_request(
+                    build(random.randrange(args.rows)), fmt=args.format
+                )
+                for _ in range(args.requests)
+            ]
+
+        print(
+            f"\n{'接口':<22}{'req/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'错误':>6}"
+        )
+
+        if "verify" in endpoints:
+
+            def build_verify(i: int) -> Dict[str, Any]:
+                if i % 2:
+                    return {"device_id": device_id(i)}
+                return {
+                    "device_id": device_id(i // 2),
+                    "authorization": f"Bearer {token(i)}",
+                }
+
+            summarize(
+                "/api/secure/verify",
+                *await run_load(
+                    http,
+                    "/api/secure/verify",
+                    make_bodies(build_verify),
+                    args.concurrency,
+                    secure_check,
+                ),
+            )
+
+        if "verify_batch" in endpoints:
+
+            def build_verify_batch(i: int) -> Dict[str, Any]:
+                # 模拟多账号客户端：同一设备下的多个账号各带自己的 Token
+                return {
+                    "items": [
+                        {
+                            "device_id": device_id(j // 2),
+                            "authorization": f"Bearer {token(j)}",
+                        }
+                        for j in ((i + k) % args.rows for k in range(args.batch_size))
+                    ]
+                }
+
+            summarize(
+                "/api/secure/verify_batch",
+                *await run_load(
+                    http,
+                    "/api/secure/verify_batch",
+                    make_bodies(build_verify_batch),
+                    args.concurrency,
+                    secure_check,
+                ),
+            )
+
+        if "token" in endpoints:
+
+            def build_token(i: int) -> Dict[str, Any]:
+                return {"device_id": device_id(i // 2), "alipay_id": alipay_id(i)}
+
+            summarize(
+                "/api/secure/token",
+                *await run_load(
+                    http,
+                    "/api/secure/token",
+                    make_bodies(build_token),
+                    args.concurrency,
+                    secure_check,
+                ),
+            )
+
+        if "public_key" in endpoints:
+            summarize(
+                "/api/public_key",
+                *await run_load(
+                    http,
+                    "/api/public_key",
+                    [(None, None)] * args.requests,
+                    args.concurrency,
+                    lambda response, _: response.status_code == 200,
+                ),
+            )
+
+        print(
+            f"\n{'加解密':<22}{'ops/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+        )
+        bench_crypto(
+            server.rsa_manager, secure_client, args.crypto_iterations, args.format
+        )
+
+    await get_global_engine().dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,104 @@
+# bench_lookup.py - 热点查询列索引前后的查询延迟对比
+#
+# 用法（项目根目录）：
+#   python benchmarks/bench_lookup.py --rows 100000 --queries 500
+#
+# 在临时 SQLite 数据库中写入 N 行数据，先删除热点列索引模拟旧表结构测量一次，
+# 再通过 shared.migrate 补齐索引后测量一次，输出各查询的 p50/p99 延迟。
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="热点查询列索引基准测试")
+    parser.add_argument("--rows", type=int, default=100_000, help="每张表的行数")
+    parser.add_argument("--queries", type=int, default=500, help="每种查询的次数")
+    return parser.parse_args()
+
+
+async def main(rows: int, queries: int):
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_lookup.db")
+    os.environ["DATABASE_URI"] = f"sqlite+aiosqlite:///{db_path}"
+
+    from sqlalchemy import select, text
+
+    from fixture import device_id, seed, token
+    from shared.database import (
+        AlipayUser,
+        AsyncSessionLocal,
+        Base,
+        Device,
+        TgUser,
+        get_global_engine,
+        init_db,
+    )
+    from shared.migrate import migrate_db
+
+    engine = get_global_engine()
+    await init_db()
+
+    # 删除热点列索引，模拟旧表结构
+    async with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+    print(f"写入数据：每张表 {rows} 行 -> {db_path}")
+    await seed(engine, rows)
+
+    cases = {
+        "TgUser.tg_id": lambda i: select(TgUser).where(TgUser.tg_id == i),
+        "Device.device_id": lambda i: select(Device).where(
+            Device.device_id == device_id(i)
+        ),
+        "Device.tg_id": lambda i: select(Device).where(Device.tg_id == i),
+        "AlipayUser.tg_id": lambda i: select(AlipayUser).where(
+            AlipayUser.tg_id == i // 2
+        ),
+        "AlipayUser.token": lambda i: select(AlipayUser).where(
+            AlipayUser.token == token(i)
+        ),
+    }
+
+    async def measure() -> dict[str, list[float]]:
+        samples = {name: [] for name in cases}
+        async with AsyncSessionLocal() as db:
+            for name, build in cases.items():
+                for _ in range(queries):
+                    stmt = build(random.randrange(rows))
+                    start = time.perf_counter()
+                    (await db.execute(stmt)).scalars().first()
+                    samples[name].append((time.perf_counter() - start) * 1000)
+        return samples
+
+    before = await measure()
+    await migrate_db(engine)
+    after = await measure()
+    await engine.dispose()
+
+    def pct(values: list[float], q: int) -> float:
+        return statistics.quantiles(values, n=100)[q - 1]
+
+    print(f"\n{'查询':<20}{'无索引 p50/p99 (ms)':>24}{'有索引 p50/p99 (ms)':>24}")
+    for name in cases:
+        b, a = before[name], after[name]
+        print(
+            f"{name:<20}{pct(b, 50):>12.3f}{pct(b, 99):>12.3f}"
+            f"{pct(a, 50):>12.3f}{pct(a, 99):>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(main(args.rows, args.queries))
@@ -0,0 +1,85 @@
+# client.py - 模拟 Xposed 模块的加密请求构造（供基准测试使用）
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+import msgpack
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+SIGNATURE_KEY = os.getenv("SECURITY_SIGNATURE_KEY", "sesame-fansirsqi-byseven-2025")
+
+
+class SecureClient:
+    """按服务端协议构造 EncryptedRequest 并解密 EncryptedResponse"""
+
+    def __init__(self, public_key_pem: str):
+        self.public_key = serialization.load_pem_public_key(public_key_pem.encode())
+
+    def encrypt_request(
+        self,
+        payload: Dict[str, Any],
+        aes_key: Optional[bytes] = None,
+        sid: Optional[str] = None,
+        fmt: str = "json",
+    ) -> tuple[Dict[str, Any], bytes]:
+        """
+        返回 (EncryptedRequest 字典, AES密钥)；传入 sid 时不再携带 RSA 加密的密钥
+        fmt 为 msgpack 时明文使用 msgpack 编码，服务端以相同格式返回
+        """
+        aes_key = aes_key or AESGCM.generate_key(bit_length=256)
+        key = ""
+        if not sid:
+            key = base64.b64encode(
+                self.public_key.encrypt(
+                    aes_key,
+                    padding.OAEP(
+                        mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                        algorithm=hashes.SHA256(),
+                        label=None,
+                    ),
+                )
+            ).decode()
+        iv = os.urandom(12)
+        plaintext = (
+            msgpack.packb(payload) if fmt == "msgpack" else json.dumps(payload).encode()
+        )
+        sealed = AESGCM(aes_key).encrypt(iv, plaintext, None)
+        request = {
+            "key": key,
+            "data": base64.b64encode(sealed[:-16]).decode(),
+            "iv": base64.b64encode(iv).decode(),
+            "tag": base64.b64encode(sealed[-16:]).decode(),
+            "ts": int(time.time()),
+        }
+        if sid:
+            request["sid"] = sid
+        if fmt != "json":
+            request["fmt"] = fmt
+        sig_data = (
+            request["key"]
+            + request["data"]
+            + request["iv"]
+            + request["tag"]
+            + str(request["ts"])
+            + (sid or "")
+        )
+        request["sig"] = hmac.new(
+            SIGNATURE_KEY.encode(), sig_data.encode(), hashlib.sha256
+        ).hexdigest()
+        return request, aes_key
+
+    @staticmethod
+    def decrypt_response(
+        response: Dict[str, Any], aes_key: bytes, fmt: str = "json"
+    ) -> Dict[str, Any]:
+        iv = base64.b64decode(response["iv"])
+        sealed = base64.b64decode(response["data"]) + base64.b64decode(response["tag"])
+        plaintext = AESGCM(aes_key).decrypt(iv, sealed, None)
+        return msgpack.unpackb(plaintext) if fmt == "msgpack" else json.loads(plaintext)
@@ -0,0 +1,47 @@
+# fixture.py - 基准测试数据集（每张表 N 行，互相关联）
+#
+# 第 i 个TG用户: tg_id=i, 绑定设备 device_id(i)
+# 第 i 个支付宝账号: alipay_id(i), 属于TG用户 i // 2, 绑定设备 device_id(i // 2), Token=token(i)
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+def device_id(i: int) -> str:
+    return f"device{i:026d}"
+
+
+def alipay_id(i: int) -> str:
+    return f"{i:016d}"
+
+
+def token(i: int) -> str:
+    return f"token{i:027d}"
+
+
+async def seed(engine: AsyncEngine, rows: int):
+    from shared.database import AlipayUser, Device, TgUser
+
+    async with engine.begin() as conn:
+        await conn.execute(
+            insert(TgUser),
+            [{"tg_id": i, "username": f"user{i}"} for i in range(rows)],
+        )
+        await conn.execute(
+            insert(Device),
+            [{"tg_id": i, "device_id": device_id(i)} for i in range(rows)],
+        )
+        await conn.execute(
+            insert(AlipayUser),
+            [
+                {
+                    "tg_id": i // 2,
+                    "alipay_id": alipay_id(i),
+                    "device_id": device_id(i // 2),
+                    "token": token(i),
+                    "device_ban": 0,
+                    "account_ban": 0,
+                }
+                for i in range(rows)
+            ],
+        )
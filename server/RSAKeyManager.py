@@ -1,149 +1,350 @@
 import base64
+import glob
 import hashlib
 import hmac
-import json
 import os
+import re
 import time
-from typing import Any, Dict
+from collections import Counter
+from typing import Any, Dict, Optional
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from fastapi import HTTPException
+from filelock import FileLock
 from log import logger
 from webmodel import EncryptedRequest
 
 # 签名密钥（应从环境变量获取）
 SIGNATURE_KEY = os.getenv("SECURITY_SIGNATURE_KEY", "sesame-fansirsqi-byseven-2025")
+# 预先完成 HMAC 密钥初始化，每次验证只需 copy()
+_SIGNATURE_HMAC = hmac.new(SIGNATURE_KEY.encode(), digestmod=hashlib.sha256)
+
+
+def _key_id(public_key) -> str:
+    der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return hashlib.sha256(der).hexdigest()[:16]
+
+
+def _write_atomic(path: str, content: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 
 class RSAKeyManager:
+    """
+    RSA 密钥环
+    - 主密钥：private_key_path / public_key_path，由 /api/public_key 下发，不存在时自动生成
+    - 旧密钥：keyring_dir（默认主密钥同级的 keys 目录，或 KEYRING_DIR）中的 *.pem 私钥，
+      轮换后仍可解密携带旧 kid 的请求
+    所有密钥按 kid（公钥 SHA-256 指纹前 16 位）索引；reload_if_changed() 在文件变化时热加载
+    只有初始化时会生成密钥，热加载只读取已有文件
+    """
+
     def __init__(
         self,
         private_key_path: str = "./server/private_key.pem",
         public_key_path: str = "./server/public_key.pem",
+        keyring_dir: Optional[str] = None,
     ):
         self.private_key_path = private_key_path
         self.public_key_path = public_key_path
+        self.keyring_dir = (
+            keyring_dir
+            or os.getenv("KEYRING_DIR")
+            or os.path.join(os.path.dirname(private_key_path), "keys")
+        )
         self.private_key = None
         self.public_key = None
+        self.keys: Dict[str, Any] = {}
+        self._stamp: tuple = ()
+        stamp = self._files_stamp()
         self.load_or_generate_keys()
+        self._cache_public_key()
+        self.keys = self._load_keyring(self.kid, self.private_key)
+        self._stamp = stamp
 
-    def load_or_generate_keys(self):
-        # 如果密钥文件存在，加载它们
-        if os.path.exists(self.private_key_path) and os.path.exists(
-            self.public_key_path
-        ):
-            with open(self.private_key_path, "rb") as f:
-                self.private_key = serialization.load_pem_private_key(
-                    f.read(), password=None, backend=default_backend()
-                )
-            with open(self.public_key_path, "rb") as f:
-                self.public_key = serialization.load_pem_public_key(
-                    f.read(), backend=default_backend()
+    def _files_stamp(self) -> tuple:
+        """密钥文件及其修改时间，用于判断是否需要热加载"""
+        paths = [self.private_key_path, self.public_key_path]
+        paths += sorted(glob.glob(os.path.join(self.keyring_dir, "*.pem")))
+        stamp = []
+        for path in paths:
+            try:
+                stamp.append((path, os.stat(path).st_mtime_ns))
+            except FileNotFoundError:
+                pass
+        return tuple(stamp)
+
+    def _load_keyring(self, kid: str, private_key) -> Dict[str, Any]:
+        keys = {kid: private_key}
+        for path in sorted(glob.glob(os.path.join(self.keyring_dir, "*.pem"))):
+            try:
+                with open(path, "rb") as f:
+                    key = serialization.load_pem_private_key(
+                        f.read(), password=None, backend=default_backend()
+                    )
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(
+                    "跳过无法加载的密钥文件: {path} | {error}", path=path, error=str(e)
                 )
-        else:
-            # 生成新的RSA密钥对
-            self.private_key = rsa.generate_private_key(
-                public_exponent=65537, key_size=2048, backend=default_backend()
-            )
-            self.public_key = self.private_key.public_key()
+                continue
+            keys.setdefault(_key_id(key.public_key()), key)
+        return keys
 
-            # 保存私钥
-            pem = self.private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption(),
+    def reload_if_changed(self) -> bool:
+        """密钥文件有变化时重新加载密钥环，返回是否发生了变化"""
+        stamp = self._files_stamp()
+        if stamp == self._stamp:
+            return False
+        try:
+            private_key, public_key = self._read_keys()
+            if _key_id(private_key.public_key()) != _key_id(public_key):
+                # 轮换时先写公钥再写私钥，两者不匹配说明正在写入，下次检查再加载
+                raise ValueError("主密钥的公钥与私钥不匹配")
+            keys = self._load_keyring(_key_id(public_key), private_key)
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning("密钥热加载失败，继续使用旧密钥: {error}", error=str(e))
+            return False
+        # 全部读取成功后再替换；解密线程按 kid 取到的密钥对象始终完整可用
+        self.private_key, self.public_key = private_key, public_key
+        self._cache_public_key()
+        self.keys = keys
+        self._stamp = stamp
+        logger.info(
+            "密钥环已重新加载：[主密钥: {kid} | 可用密钥: {count}]",
+            kid=self.kid,
+            count=len(self.keys),
+        )
+        return True
+
+    def get_key(self, kid: Optional[str]):
+        """按 kid 取私钥对象，kid 为空时为主密钥，不存在时返回 None"""
+        return self.private_key if kid is None else self.keys.get(kid)
+
+    def load_or_generate_keys(self):
+        # 多个 worker 同时启动时，只允许一个进程生成密钥，其余等待后直接加载
+        with FileLock(self.private_key_path + ".lock"):
+            if not (
+                os.path.exists(self.private_key_path)
+                and os.path.exists(self.public_key_path)
+            ):
+                self._generate_keys()
+
+        # 加载密钥
+        self.private_key, self.public_key = self._read_keys()
+
+    def _read_keys(self) -> tuple:
+        """读取主密钥对（不生成），文件不存在时抛出 FileNotFoundError"""
+        with open(self.private_key_path, "rb") as f:
+            private_key = serialization.load_pem_private_key(
+                f.read(), password=None, backend=default_backend()
             )
-            with open(self.private_key_path, "wb") as f:
-                f.write(pem)
+        with open(self.public_key_path, "rb") as f:
+            public_key = serialization.load_pem_public_key(
+                f.read(), backend=default_backend()
+            )
+        return private_key, public_key
+
+    def _generate_keys(self):
+        # 生成新的RSA密钥对
+        private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048, backend=default_backend()
+        )
 
-            # 保存公钥
-            pem = self.public_key.public_bytes(
+        # 先写公钥再写私钥，均通过临时文件 + 原子替换，避免读到写了一半的文件
+        _write_atomic(
+            self.public_key_path,
+            private_key.public_key().public_bytes(
                 encoding=serialization.Encoding.PEM,
                 format=serialization.PublicFormat.SubjectPublicKeyInfo,
-            )
-            with open(self.public_key_path, "wb") as f:
-                f.write(pem)
+            ),
+        )
+        _write_atomic(
+            self.private_key_path,
+            private_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption(),
+            ),
+        )
 
-    def get_public_key_pem(self) -> str:
-        """获取PEM格式的公钥，用于Xposed模块"""
-        pem = self.public_key.public_bytes(
+    def _cache_public_key(self):
+        """加载密钥时一次性计算公钥的各种编码与指纹，避免每次请求重复序列化"""
+        self.public_key_pem = self.public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        ).decode("utf-8")
+        der = self.public_key.public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
         )
-        return pem.decode("utf-8")
-
-    def decrypt_aes_key(self, encrypted_key: bytes) -> bytes:
-        """使用私钥解密AES密钥"""
-        return self.private_key.decrypt(
-            encrypted_key,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None,
-            ),
-        )
+        self.public_key_der_b64 = base64.b64encode(der).decode("utf-8")
+        self.fingerprint = hashlib.sha256(der).hexdigest()
+        self.kid = self.fingerprint[:16]
+        # 弱校验器：响应体中的 timestamp 每秒变化，只有公钥部分与指纹对应
+        self.etag = f'W/"{self.fingerprint[:32]}"'
+
+    def get_public_key_pem(self) -> str:
+        """获取PEM格式的公钥，用于Xposed模块"""
+        return self.public_key_pem
+
 
-    def encrypt_response(self, data: Dict[str, Any], aes_key: bytes) -> Dict[str, str]:
-        """使用AES密钥加密响应数据"""
-        iv = os.urandom(12)  # GCM标准IV长度
-        encryptor = Cipher(
-            algorithms.AES(aes_key), modes.GCM(iv), backend=default_backend()
-        ).encryptor()
-
-        # 添加时间戳防止重放攻击
-        data["ts"] = int(time.time())
-        data_bytes = json.dumps(data).encode("utf-8")
-        ciphertext = encryptor.update(data_bytes) + encryptor.finalize()
-
-        return {
-            "iv": base64.b64encode(iv).decode("utf-8"),
-            "data": base64.b64encode(ciphertext).decode("utf-8"),
-            "tag": base64.b64encode(encryptor.tag).decode("utf-8"),
-        }
-
-
-def verify_request_signature(request_data: Dict[str, Any], signature_key: str) -> bool:
-    """验证请求签名"""
-    # 构建签名数据（按字段名排序以确保一致性）
-    sig_data = (
-        request_data.get("key", "")
-        + request_data.get("data", "")
-        + request_data.get("iv", "")
-        + request_data.get("tag", "")
-        + str(request_data.get("ts", 0))
+def _unwrap_key(private_key, encrypted_key: bytes) -> bytes:
+    return private_key.decrypt(
+        encrypted_key,
+        padding.OAEP(
+            mgf=padding.MGF1(algorithm=hashes.SHA256()),
+            algorithm=hashes.SHA256(),
+            label=None,
+        ),
     )
 
-    expected_sig = hmac.new(
-        key=signature_key.encode(), msg=sig_data.encode(), digestmod=hashlib.sha256
-    ).hexdigest()
 
-    return hmac.compare_digest(expected_sig, request_data.get("sig", ""))
+def encrypt_payload(plaintext: bytes, aes_key: bytes) -> Dict[str, str]:
+    """使用AES密钥加密已序列化的响应字节"""
+    iv = os.urandom(12)  # GCM标准IV长度
+    encryptor = Cipher(
+        algorithms.AES(aes_key), modes.GCM(iv), backend=default_backend()
+    ).encryptor()
+    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
 
+    return {
+        "iv": base64.b64encode(iv).decode("utf-8"),
+        "data": base64.b64encode(ciphertext).decode("utf-8"),
+        "tag": base64.b64encode(encryptor.tag).decode("utf-8"),
+    }
 
-def decrypt_request(
-    encrypted_request: EncryptedRequest, rsa_manager: RSAKeyManager
-) -> tuple[Dict[str, Any], bytes]:
-    """解密客户端请求，并返回解密后的数据和AES密钥"""
+
+def _signature_hmac(mac, key: str, data: str, iv: str, tag: str, ts, sid: str):
+    # 签名数据为 key + data + iv + tag + ts + sid，逐段 update 避免拼接大字符串
+    for part in (key, data, iv, tag, str(ts), sid):
+        mac.update(part.encode())
+    return mac
+
+
+def _verify_signature(encrypted_request: EncryptedRequest) -> bool:
+    mac = _signature_hmac(
+        _SIGNATURE_HMAC.copy(),
+        encrypted_request.key,
+        encrypted_request.data,
+        encrypted_request.iv,
+        encrypted_request.tag,
+        encrypted_request.ts,
+        encrypted_request.sid or "",
+    )
     try:
-        # 1. 验证时间戳（防止重放攻击，允许5分钟内的时间差）
-        current_time = int(time.time())
-        if abs(current_time - encrypted_request.ts) > 300:
-            logger.warning(
-                f"重放攻击检测: 时间差 {abs(current_time - encrypted_request.ts)} 秒"
-            )
-            raise HTTPException(status_code=401, detail="请求已过期")
+        return hmac.compare_digest(mac.digest(), bytes.fromhex(encrypted_request.sig))
+    except ValueError:
+        return False
+
+
+REQUEST_MAX_AGE = 300
+"请求时间戳允许的最大偏差（秒）"
+
 
-        # 2. 验证签名
-        request_dict = encrypted_request.dict()
-        if not verify_request_signature(request_dict, SIGNATURE_KEY):
-            logger.warning("请求签名验证失败")
-            raise HTTPException(status_code=401, detail="请求签名无效")
+# 字段长度上限（base64 字符数）：RSA-4096 包装的密钥 684，GCM IV 12~16 字节，标签 16 字节
+MAX_KEY_LENGTH = 700
+MAX_DATA_LENGTH = int(os.getenv("MAX_REQUEST_DATA", 64 * 1024))
+MAX_IV_LENGTH = 24
+MAX_TAG_LENGTH = 24
+MAX_SID_LENGTH = 64
+MAX_KID_LENGTH = 16
+SIG_LENGTH = 64
 
+_BASE64 = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+_WHITESPACE = re.compile(r"\s+")
+
+rejections: Counter = Counter()
+"各校验阶段的拒绝次数：size / expired / shape / signature"
+
+
+def _reject(stage: str, detail: str, status_code: int = 400):
+    rejections[stage] += 1
+    raise HTTPException(status_code=status_code, detail=detail)
+
+
+def _is_base64(value: str) -> bool:
+    # 与 base64.b64decode 一致，容忍按行折断的编码（如 76 列换行），忽略空白后再检查
+    value = _WHITESPACE.sub("", value)
+    return len(value) % 4 == 0 and _BASE64.fullmatch(value) is not None
+
+
+def validate_request(encrypted_request: EncryptedRequest):
+    """
+    廉价校验（不涉及RSA/AES），按成本从低到高分阶段，失败抛出 HTTPException：
+    长度 -> 时间戳 -> base64 格式 -> 签名
+    """
+    r = encrypted_request
+    # 1. 长度
+    if (
+        len(r.key) > MAX_KEY_LENGTH
+        or len(r.data) > MAX_DATA_LENGTH
+        or len(r.iv) > MAX_IV_LENGTH
+        or len(r.tag) > MAX_TAG_LENGTH
+        or len(r.sig) != SIG_LENGTH
+        or (r.sid is not None and len(r.sid) > MAX_SID_LENGTH)
+        or (r.kid is not None and len(r.kid) > MAX_KID_LENGTH)
+    ):
+        _reject("size", "请求字段长度不合法")
+
+    # 2. 验证时间戳（防止重放攻击，允许5分钟内的时间差）
+    current_time = int(time.time())
+    if abs(current_time - r.ts) > REQUEST_MAX_AGE:
+        logger.warning("重放攻击检测: 时间差 {skew} 秒", skew=abs(current_time - r.ts))
+        _reject("expired", "请求已过期", 401)
+
+    # 3. base64 格式（需扫描整个 data 字段）
+    if not (
+        _is_base64(r.key)
+        and _is_base64(r.data)
+        and _is_base64(r.iv)
+        and _is_base64(r.tag)
+    ):
+        _reject("shape", "请求字段格式不合法")
+
+    # 4. 验证签名
+    if not _verify_signature(r):
+        logger.warning("请求签名验证失败")
+        _reject("signature", "请求签名无效", 401)
+
+
+def decrypt_payload(
+    encrypted_request: EncryptedRequest,
+    rsa_manager: RSAKeyManager,
+    aes_key: Optional[bytes] = None,
+    timings: Optional[Dict[str, float]] = None,
+    private_key=None,
+) -> tuple[bytes, bytes]:
+    """
+    解密已通过校验的请求，返回解密后的明文字节（由调用方按格式解析）和AES密钥
+    若传入 aes_key（会话复用命中），则跳过RSA解密
+    若传入 timings，则写入 rsa_unwrap / aes_decrypt 两个阶段的耗时（秒）
+    若传入 private_key（调用方校验 kid 时取到的密钥对象），则直接使用，不再按 kid 查找密钥环
+    """
+    try:
         # 3. 解密AES密钥
-        encrypted_key = base64.b64decode(encrypted_request.key)
-        aes_key = rsa_manager.decrypt_aes_key(encrypted_key)
+        start = time.perf_counter()
+        if aes_key is None:
+            if not encrypted_request.key:
+                raise ValueError("缺少加密的AES密钥")
+            encrypted_key = base64.b64decode(encrypted_request.key)
+            if private_key is None:
+                private_key = rsa_manager.get_key(encrypted_request.kid)
+                if private_key is None:
+                    raise ValueError("未知的 kid")
+            aes_key = _unwrap_key(private_key, encrypted_key)
+            if timings is not None:
+                timings["rsa_unwrap"] = time.perf_counter() - start
+                start = time.perf_counter()
 
         # 4. 解密数据
         iv = base64.b64decode(encrypted_request.iv)
@@ -155,8 +356,10 @@ def decrypt_request(
         ).decryptor()
 
         decrypted_data = decryptor.update(ciphertext) + decryptor.finalize()
-        return json.loads(decrypted_data.decode("utf-8")), aes_key
+        if timings is not None:
+            timings["aes_decrypt"] = time.perf_counter() - start
+        return decrypted_data, aes_key
 
     except Exception as e:
-        logger.error(f"请求解密失败: {str(e)}")
+        logger.error("请求解密失败: {error}", error=str(e))
         raise HTTPException(status_code=400, detail=f"请求解密失败:{e}")
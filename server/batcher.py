@@ -0,0 +1,79 @@
+# batcher.py - 查询微批处理（合并短时间窗口内的并发点查询）
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class Batcher:
+    """
+    DataLoader 式批处理器
+
+    窗口期（window 秒）内到达的 load(key) 调用会被合并为一次 load_many(keys)，
+    达到 max_size 时立即发出；相同 key 共享同一个结果。
+    load_many 返回 {key: value}，缺失的 key 得到 None。
+    """
+
+    def __init__(
+        self,
+        load_many: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        window: float = 0.002,
+        max_size: int = 100,
+    ):
+        self.load_many = load_many
+        self.window = window
+        self.max_size = max_size
+        self._queue: Dict[Hashable, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.keys = 0
+        self.max_batch = 0
+
+    async def load(self, key: Hashable) -> Any:
+        future = self._queue.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._queue[key] = future
+            if len(self._queue) >= self.max_size:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._dispatch)
+        # 单个等待方被取消时不影响共享同一结果的其他请求
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, {}
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[Hashable, asyncio.Future]):
+        self.batches += 1
+        self.keys += len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+        try:
+            results = await self.load_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_size": self.max_size,
+            "batches": self.batches,
+            "keys": self.keys,
+            "avg_batch": self.keys / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch,
+        }
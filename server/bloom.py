@@ -0,0 +1,208 @@
+# bloom.py - 无效 Token / 设备ID 的否定查询过滤器（NEGATIVE_FILTER=true 开启）
+#
+# 对已知 token 与 device_id 各建一个布隆过滤器，验证查询前先检查：
+# 判定不存在的直接返回 204 / 208，不访问缓存与数据库；判定存在的（含少量误判）照常查询。
+#
+# 过滤器只反映上次刷新时的数据：机器人在另一进程中新绑定的设备、其他 worker 发放的 Token
+# 经增量刷新（按 updated_at）进入过滤器，在此之前的 NEGATIVE_FILTER_REFRESH_INTERVAL 秒内
+# 会被判定为不存在；本进程发放的 Token 立即加入。
+# 布隆过滤器不支持删除：解绑后的旧值仍被判定存在，只是多一次查询，由定期全量重建清除。
+
+import math
+import os
+import time
+from hashlib import blake2b
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy import func, select
+
+from dbmodel import AlipayUser, Device, get_session_local
+from log import logger
+from refresher import Refresher, later
+
+
+class BloomFilter:
+    """
+    按容量与目标误判率确定位数 m 与哈希个数 k
+    k 个位置由一次 blake2b 摘要的两半做双重哈希得到
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(
+            64,
+            math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2),
+        )
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    def estimated_error_rate(self) -> float:
+        """按已加入条目数估算的误判率 (1 - e^(-kn/m))^k"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "count": self.count,
+            "bits": self.size,
+            "hashes": self.hashes,
+            "memory_bytes": len(self.bits),
+            "estimated_error_rate": round(self.estimated_error_rate(), 6),
+        }
+
+
+class NegativeFilter(Refresher):
+    """
+    已知 token / device_id 的过滤器对
+    observed_* 统计过滤器放行但数据库未找到的次数（实际误判，含已删除的旧值）
+    """
+
+    name = "否定查询过滤器"
+
+    def __init__(
+        self,
+        error_rate: float = 0.001,
+        refresh_interval: float = 5,
+        full_interval: float = 600,
+    ):
+        super().__init__(refresh_interval, full_interval)
+        self.error_rate = error_rate
+        self.tokens = BloomFilter(1, error_rate)
+        self.devices = BloomFilter(1, error_rate)
+        self.rejected = {"token": 0, "device": 0}
+        self.passed = {"token": 0, "device": 0}
+        self.observed = {"token": 0, "device": 0}
+
+    # ===== 查询 =====
+    def may_have_token(self, token: str) -> bool:
+        return self._check("token", self.tokens, token)
+
+    def may_have_device(self, device_id: str) -> bool:
+        return self._check("device", self.devices, device_id)
+
+    def _check(self, kind: str, bloom: BloomFilter, item: str) -> bool:
+        if not self.loaded or item in bloom:
+            self.passed[kind] += 1
+            return True
+        self.rejected[kind] += 1
+        return False
+
+    def record_miss(self, kind: str):
+        """过滤器放行后数据库仍未找到"""
+        if self.loaded:
+            self.observed[kind] += 1
+
+    # ===== 写入 =====
+    def add_token(self, token: str):
+        self.tokens.add(token)
+
+    def add_device(self, device_id: str):
+        self.devices.add(device_id)
+
+    # ===== 加载 =====
+    async def load(self):
+        """全量重建：按当前行数的 2 倍确定容量，为后续增量加入留出余量"""
+        async with get_session_local()() as db:
+            # 先取水位线再读行，读取期间写入的行由下次增量刷新补上
+            watermark = later(
+                await db.scalar(select(func.max(AlipayUser.updated_at))),
+                await db.scalar(select(func.max(Device.updated_at))),
+            )
+            tokens = (
+                await db.scalars(
+                    select(AlipayUser.token).where(AlipayUser.token.is_not(None))
+                )
+            ).all()
+            device_ids = (
+                await db.scalars(
+                    select(Device.device_id).where(Device.device_id.is_not(None))
+                )
+            ).all()
+
+        token_bloom = BloomFilter(max(1024, len(tokens) * 2), self.error_rate)
+        for token in tokens:
+            token_bloom.add(token)
+        device_bloom = BloomFilter(max(1024, len(device_ids) * 2), self.error_rate)
+        for device_id in device_ids:
+            device_bloom.add(device_id)
+
+        self.tokens, self.devices = token_bloom, device_bloom
+        self._watermark = watermark
+        self._last_full = time.monotonic()
+        self.loaded = True
+        logger.info(
+            "否定查询过滤器已重建：[Token: {tokens} | 设备: {devices} | 内存: {memory} 字节]",
+            tokens=len(tokens),
+            devices=len(device_ids),
+            memory=len(token_bloom.bits) + len(device_bloom.bits),
+        )
+
+    async def refresh(self):
+        """增量加入 updated_at 不早于上次水位线（减去重叠窗口）的 token / device_id"""
+        tokens = select(AlipayUser.token, AlipayUser.updated_at).where(
+            AlipayUser.token.is_not(None)
+        )
+        devices = select(Device.device_id, Device.updated_at).where(
+            Device.device_id.is_not(None)
+        )
+        if self._watermark is not None:
+            since = self._watermark - self.overlap
+            tokens = tokens.where(AlipayUser.updated_at >= since)
+            devices = devices.where(Device.updated_at >= since)
+
+        watermark = self._watermark
+        async with get_session_local()() as db:
+            for token, updated_at in await db.execute(tokens):
+                self.tokens.add(token)
+                watermark = later(watermark, updated_at)
+            for device_id, updated_at in await db.execute(devices):
+                self.devices.add(device_id)
+                watermark = later(watermark, updated_at)
+        self._watermark = watermark
+
+    def stats(self) -> Dict[str, Any]:
+        def observed_rate(kind: str) -> float:
+            negatives = self.rejected[kind] + self.observed[kind]
+            return round(self.observed[kind] / negatives, 6) if negatives else 0.0
+
+        return {
+            kind: {
+                **bloom.stats(),
+                "rejected": self.rejected[kind],
+                "passed": self.passed[kind],
+                "observed_false_positives": self.observed[kind],
+                "observed_error_rate": observed_rate(kind),
+            }
+            for kind, bloom in (("token", self.tokens), ("device", self.devices))
+        } | {
+            "memory_bytes": len(self.tokens.bits) + len(self.devices.bits),
+            "watermark": self._watermark.isoformat() if self._watermark else None,
+        }
+
+
+negative_filter: Optional[NegativeFilter] = None
+if os.getenv("NEGATIVE_FILTER", "False").lower() in ("true", "1", "t"):
+    negative_filter = NegativeFilter(
+        error_rate=float(os.getenv("NEGATIVE_FILTER_ERROR_RATE", 0.001)),
+        refresh_interval=float(os.getenv("NEGATIVE_FILTER_REFRESH_INTERVAL", 5)),
+        full_interval=float(os.getenv("NEGATIVE_FILTER_FULL_INTERVAL", 600)),
+    )
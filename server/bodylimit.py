@@ -0,0 +1,64 @@
+# bodylimit.py - 请求体大小限制（在 JSON 解析之前拒绝超大请求）
+
+import json
+
+
+class BodySizeLimitMiddleware:
+    """
+    限制 paths 中路径的请求体大小，超出 max_body 字节直接返回 413
+    - 带 Content-Length：只看请求头，不读取请求体
+    - 分块传输：在中间件内边读边计数，超限即拒绝，未超限时原样交给应用
+    """
+
+    _BODY = json.dumps({"detail": "请求体过大"}).encode()
+
+    def __init__(self, app, max_body: int, paths: tuple[str, ...]):
+        self.app = app
+        self.max_body = max_body
+        self.paths = paths
+
+    async def _reject(self, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(self._BODY)).encode()),
+                    (b"connection", b"close"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": self._BODY})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length":
+                if not value.isdigit() or int(value) > self.max_body:
+                    return await self._reject(send)
+                return await self.app(scope, receive, send)
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            body += message.get("body", b"")
+            if len(body) > self.max_body:
+                return await self._reject(send)
+            if not message.get("more_body", False):
+                break
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": bytes(body), "more_body": False}
+
+        await self.app(scope, replay, send)
@@ -0,0 +1,31 @@
+# codec.py - 加密信封内明文的序列化（JSON / msgpack）
+
+import time
+from typing import Type, TypeVar
+
+import msgpack
+from pydantic import BaseModel
+
+M = TypeVar("M", bound=BaseModel)
+
+FORMATS = ("json", "msgpack")
+"客户端可通过 EncryptedRequest.fmt 选择的明文格式，响应使用与请求相同的格式"
+
+
+def load_request(model: Type[M], plaintext: bytes, fmt: str = "json") -> M:
+    """直接由解密后的字节校验出请求模型，JSON 不经过中间 dict"""
+    if fmt == "msgpack":
+        return model.model_validate(msgpack.unpackb(plaintext))
+    return model.model_validate_json(plaintext)
+
+
+def dump_response(response: BaseModel, fmt: str = "json") -> bytes:
+    """将响应模型序列化为待加密的字节，并附加时间戳 ts（防重放）"""
+    ts = int(time.time())
+    if fmt == "msgpack":
+        data = response.model_dump(exclude_none=True)
+        data["ts"] = ts
+        return msgpack.packb(data)
+    # 直接由 pydantic-core 输出 JSON 字节，再把 ts 拼入对象末尾（响应至少含 status/message）
+    raw = response.__pydantic_serializer__.to_json(response, exclude_none=True)
+    return b'%s,"ts":%d}' % (raw[:-1], ts)
@@ -0,0 +1,289 @@
+# cryptopool.py - 加解密工作池（将 RSA/AES 运算移出事件循环）
+
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from log import logger
+from metrics import metrics
+from replay import replay_guard_from_env
+from RSAKeyManager import (
+    REQUEST_MAX_AGE,
+    RSAKeyManager,
+    decrypt_payload,
+    encrypt_payload,
+    rejections,
+    validate_request,
+)
+from shared.cache import TTLCache
+from webmodel import EncryptedRequest
+
+
+class PoolBusyError(HTTPException):
+    """工作池排队已满，直接拒绝请求"""
+
+    def __init__(self):
+        super().__init__(status_code=503, detail="服务器繁忙，请稍后重试")
+
+
+class SessionExpiredError(HTTPException):
+    """会话ID不存在或已过期，客户端需重新携带RSA加密的密钥"""
+
+    def __init__(self):
+        super().__init__(status_code=401, detail="会话已过期，请重新握手")
+
+
+class UnknownKeyError(HTTPException):
+    """kid 不在密钥环中（密钥已下线），客户端需重新获取公钥"""
+
+    def __init__(self):
+        super().__init__(status_code=401, detail="密钥已轮换，请重新获取公钥")
+
+
+# ===== 进程池工作进程状态 =====
+_worker_manager: Optional[RSAKeyManager] = None
+
+
+def _init_worker(private_key_path: str, public_key_path: str, keyring_dir: str):
+    """进程池初始化：每个工作进程各自加载一次密钥环"""
+    global _worker_manager
+    _worker_manager = RSAKeyManager(private_key_path, public_key_path, keyring_dir)
+
+
+def _process_decrypt(
+    encrypted_request: EncryptedRequest, aes_key: Optional[bytes], kid: str
+):
+    # HTTPException 无法跨进程 pickle，改为返回错误元组；阶段耗时随结果一并带回
+    timings: Dict[str, float] = {}
+    if kid not in _worker_manager.keys:
+        # 主进程已确认 kid 有效，说明本进程的密钥环落后，按需热加载
+        _worker_manager.reload_if_changed()
+    # kid 由主进程解析（未携带时为主进程的主密钥），避免使用本进程过期的主密钥
+    private_key = _worker_manager.keys.get(kid)
+    if private_key is None:
+        return False, (401, "密钥已轮换，请重新获取公钥")
+    try:
+        plaintext, aes_key = decrypt_payload(
+            encrypted_request, _worker_manager, aes_key, timings, private_key
+        )
+        return True, (plaintext, aes_key, timings)
+    except HTTPException as e:
+        return False, (e.status_code, e.detail)
+
+
+def _timed(fn, *args):
+    """在工作线程/进程内计时，不包含排队等待时间"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class CryptoPool:
+    """
+    有界加解密工作池
+
+    - mode: thread / process / off（off 时直接在事件循环内执行）
+    - workers: 工作线程/进程数，默认 CPU 核数
+    - max_pending: 允许排队+执行中的最大任务数，超出时返回 503
+    - session_resume: 会话复用模式，缓存已解出的AES密钥，命中时跳过RSA解密
+
+    解密前先在事件循环内完成时间戳、签名和重放检查，不合格的请求不会进入工作池
+    """
+
+    def __init__(
+        self,
+        rsa_manager: RSAKeyManager,
+        mode: Optional[str] = None,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        session_resume: Optional[bool] = None,
+    ):
+        self.rsa_manager = rsa_manager
+        self.mode = (mode or os.getenv("CRYPTO_POOL_MODE", "thread")).lower()
+        self.workers = workers or int(
+            os.getenv("CRYPTO_POOL_WORKERS", 0) or os.cpu_count() or 1
+        )
+        self.max_pending = max_pending or int(
+            os.getenv("CRYPTO_POOL_MAX_PENDING", 0) or self.workers * 64
+        )
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._executor: Optional[Executor] = None
+
+        if session_resume is None:
+            session_resume = os.getenv("SESSION_RESUME", "False").lower() in (
+                "true",
+                "1",
+                "t",
+            )
+        self.replay_guard = replay_guard_from_env(REQUEST_MAX_AGE)
+
+        self.sessions: Optional[TTLCache] = None
+        if session_resume:
+            self.sessions = TTLCache(
+                maxsize=int(os.getenv("SESSION_MAX", 10000)),
+                ttl=float(os.getenv("SESSION_TTL", 600)),
+            )
+
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(
+                    rsa_manager.private_key_path,
+                    rsa_manager.public_key_path,
+                    rsa_manager.keyring_dir,
+                ),
+            )
+        elif self.mode == "thread":
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="crypto"
+            )
+        elif self.mode != "off":
+            raise ValueError(f"未知的 CRYPTO_POOL_MODE: {self.mode}")
+
+        logger.info(
+            f"加解密工作池已启动：[模式: {self.mode} | 工作数: {self.workers} | 最大排队: {self.max_pending} | 会话复用: {bool(self.sessions)}]"
+        )
+
+    async def _submit(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            raise PoolBusyError()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, fn, *args)
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._pending -= 1
+        self._completed += 1
+        return result
+
+    def session_id(self, encrypted_request: EncryptedRequest) -> Optional[str]:
+        """
+        会话ID：携带加密密钥时由服务端取其哈希（绑定到该密钥，客户端无法指定），
+        仅携带 sid 时为此前由服务端下发的 sid
+        """
+        if self.sessions is None:
+            return None
+        if encrypted_request.key:
+            return hashlib.sha256(encrypted_request.key.encode()).hexdigest()[:32]
+        return encrypted_request.sid
+
+    async def decrypt_request(
+        self, encrypted_request: EncryptedRequest
+    ) -> tuple[bytes, bytes]:
+        """
+        校验并在工作池中解密请求，返回解密后的明文字节和AES密钥
+        顺序：廉价校验 -> 重放 -> kid -> 会话复用 -> RSA/AES 解密（未成功解密时撤销重放记录）
+        """
+        start = time.perf_counter()
+        try:
+            validate_request(encrypted_request)
+        finally:
+            metrics.observe("signature", time.perf_counter() - start)
+        if self.replay_guard and not await self.replay_guard.check_and_add(
+            encrypted_request.sig, encrypted_request.ts
+        ):
+            logger.warning("重放攻击检测: 重复的请求签名")
+            raise HTTPException(status_code=401, detail="重复请求")
+        try:
+            return await self._decrypt(encrypted_request)
+        except BaseException:
+            # 请求未被处理（kid 失效、会话过期、工作池繁忙、解密失败或被取消），
+            # 撤销签名记录，客户端可原样重试；成功解密的签名保留，重放仍被拒绝
+            if self.replay_guard:
+                await self.replay_guard.discard(
+                    encrypted_request.sig, encrypted_request.ts
+                )
+            raise
+
+    async def _decrypt(
+        self, encrypted_request: EncryptedRequest
+    ) -> tuple[bytes, bytes]:
+        # 在事件循环内取一次密钥对象交给工作线程，期间热加载替换密钥环也不影响本次解密
+        private_key = self.rsa_manager.get_key(encrypted_request.kid)
+        if private_key is None:
+            rejections["kid"] += 1
+            raise UnknownKeyError()
+
+        # 携带加密密钥时总是重新解包并覆盖会话；只有复用请求才读取缓存的AES密钥
+        sid = self.session_id(encrypted_request)
+        aes_key = None
+        if not encrypted_request.key:
+            aes_key = self.sessions.get(sid) if sid else None
+            if aes_key is None:
+                raise SessionExpiredError()
+
+        if self.mode != "process":
+            timings: Dict[str, float] = {}
+            plaintext, aes_key = await self._submit(
+                decrypt_payload,
+                encrypted_request,
+                self.rsa_manager,
+                aes_key,
+                timings,
+                private_key,
+            )
+        else:
+            ok, result = await self._submit(
+                _process_decrypt,
+                encrypted_request,
+                aes_key,
+                encrypted_request.kid or self.rsa_manager.kid,
+            )
+            if not ok:
+                # 进程模式下解密失败以元组返回，_submit 已计为完成，这里改计为失败
+                self._completed -= 1
+                self._failed += 1
+                raise HTTPException(status_code=result[0], detail=result[1])
+            plaintext, aes_key, timings = result
+        for stage, seconds in timings.items():
+            metrics.observe(stage, seconds)
+
+        if sid:
+            self.sessions.set(sid, aes_key)
+        return plaintext, aes_key
+
+    async def encrypt_response(
+        self, plaintext: bytes, aes_key: bytes, sid: Optional[str] = None
+    ) -> Dict[str, str]:
+        """在工作池中加密已序列化的响应，会话复用模式下附带 sid"""
+        encrypted, seconds = await self._submit(
+            _timed, encrypt_payload, plaintext, aes_key
+        )
+        metrics.observe("aes_encrypt", seconds)
+        if sid:
+            encrypted["sid"] = sid
+        return encrypted
+
+    def stats(self) -> Dict[str, Any]:
+        """工作池指标：排队深度、拒绝数、完成数、失败数"""
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "queue_depth": self._pending,
+            "rejected": self._rejected,
+            "completed": self._completed,
+            "failed": self._failed,
+            "sessions": self.sessions.stats() if self.sessions else None,
+            "replay": self.replay_guard.stats() if self.replay_guard else None,
+            "rejections": dict(rejections),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -26,20 +26,19 @@ DATABASE_URI = get_database_uri()
 
 
 # ===== FastAPI依赖 =====
-def get_db():
-    """FastAPI dependency to get a DB session."""
-    yield from get_db_session()
+async def get_db():
+    """FastAPI dependency to get an async DB session."""
+    async for session in get_db_session():
+        yield session
 
 
 # ===== 初始化数据库（创建表）=====
-def init_db(database_uri=None):
+async def init_db():
     """
     初始化数据库，创建表
-    如果没有提供database_uri，使用环境变量或默认值
+    使用共享引擎（由环境变量 DATABASE_URI 决定）
     """
-    if database_uri is None:
-        database_uri = DATABASE_URI
-    return shared_init_db(database_uri)
+    return await shared_init_db()
 
 
 # ===== 全局引擎和会话管理器（可选）=====
@@ -1,10 +1,120 @@
 from sys import stdout
+from collections import deque
+from datetime import date, timedelta
+from typing import Optional
 from loguru import logger
+import glob
+import json
 import logging
+import os
+import random
+import threading
+import traceback
 
 logger.remove()
 LOG_FLODER = "./logs"  # 改名为logs，避免与现有目录冲突
 
+# 高频成功日志（高级验证成功 / Token发放成功）的采样率，由 configure_logging 设置
+_sample_rate = 1.0
+
+
+def log_sampled() -> bool:
+    """是否记录本条高频日志；在调用 logger 之前判断，未采中时连日志记录都不会创建"""
+    return _sample_rate >= 1 or random.random() < _sample_rate
+
+
+def _json_line(record) -> str:
+    """将 loguru 记录序列化为一行 JSON，bind/关键字参数传入的字段并入顶层"""
+    data = {
+        "time": record["time"].isoformat(timespec="milliseconds"),
+        "level": record["level"].name,
+        "msg": record["message"],
+        "src": f"{record['name']}:{record['line']}",
+    }
+    data.update(record["extra"])
+    if record["exception"] is not None:
+        data["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    return json.dumps(data, ensure_ascii=False, default=str) + "\n"
+
+
+class BatchedJsonSink:
+    """
+    批量写入的 JSON 行日志 sink
+    日志调用只把序列化后的行放入队列，由后台线程每 interval 秒或攒满 batch_size 行时一次性写入；
+    path 为空时写入标准输出，否则按天切分文件（<path>.YYYY-MM-DD），保留 retention 天
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        interval: float = 0.5,
+        batch_size: int = 512,
+        retention: int = 7,
+    ):
+        self.path = path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retention = retention
+        self._queue: deque[str] = deque()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._file = None
+        self._file_date: Optional[date] = None
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, message):
+        self._queue.append(_json_line(message.record))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def stop(self):
+        """logger.remove() / 进程退出时调用：写完剩余日志并关闭文件"""
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self._write_batch()
+        self._write_batch()
+
+    def _write_batch(self):
+        if not self._queue:
+            return
+        lines = []
+        while self._queue:
+            lines.append(self._queue.popleft())
+        stream = self._stream()
+        stream.write("".join(lines))
+        stream.flush()
+
+    def _stream(self):
+        if self.path is None:
+            return stdout
+        today = date.today()
+        if self._file_date != today:
+            if self._file is not None:
+                self._file.close()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(f"{self.path}.{today}", "a", encoding="utf-8")
+            self._file_date = today
+            self._remove_expired(today)
+        return self._file
+
+    def _remove_expired(self, today: date):
+        oldest = f"{self.path}.{today - timedelta(days=self.retention)}"
+        for name in glob.glob(f"{self.path}.*"):
+            if name < oldest:
+                os.remove(name)
+
 
 # 将 uvicorn 和标准日志转给 loguru
 class InterceptHandler(logging.Handler):
@@ -17,9 +127,34 @@ class InterceptHandler(logging.Handler):
 
 
 def configure_logging():
-    """配置日志记录器"""
+    """
+    配置日志记录器，由环境变量控制：
+    - LOG_MODE: dev（默认，彩色终端 + 文本文件）或 prod（JSON 行 + 后台批量写入）
+    - LOG_LEVEL: 最低日志级别，dev 默认 DEBUG，prod 默认 INFO；低于该级别的日志在调用处直接返回
+    - LOG_SAMPLE_RATE: 高频成功日志的采样率，dev 默认 1，prod 默认 0.01
+    """
+    global _sample_rate
     logger.remove()  # 移除默认的处理器，以便重新配置
 
+    mode = os.getenv("LOG_MODE", "dev").lower()
+    level = os.getenv("LOG_LEVEL", "DEBUG" if mode == "dev" else "INFO").upper()
+    _sample_rate = float(os.getenv("LOG_SAMPLE_RATE", 1.0 if mode == "dev" else 0.01))
+
+    if mode == "prod":
+        logger.add(BatchedJsonSink(), level=level, format="{message}")
+        logger.add(
+            BatchedJsonSink(LOG_FLODER + "/sesame-serve.jsonl"),
+            level=level,
+            format="{message}",
+        )
+        # 标准库日志在源头按级别过滤（如 aiosqlite/sqlalchemy 的 DEBUG 日志不再创建记录）
+        logging.basicConfig(
+            handlers=[InterceptHandler()],
+            level=logging.getLevelName(level),
+            force=True,
+        )
+        return
+
     # 过滤掉文件变化的调试日志
     def filter_file_changes(record):
         message = str(record["message"])
@@ -34,7 +169,7 @@ def configure_logging():
     logger.add(
         stdout,
         colorize=True,
-        level="DEBUG",
+        level=level,
         format="<y><b>{time:MM-DD HH:mm:ss}</b></y> <level><w>[</w>{level}<w>]</w></level> | <level>{message}</level>",
         filter=filter_file_changes,  # 添加过滤器
     )
@@ -42,7 +177,7 @@ def configure_logging():
     # 2. 配置文件输出
     logger.add(
         LOG_FLODER + "/sesame-serve.log",
-        level="DEBUG",
+        level=level,
         encoding="utf-8",
         format="{time:MM-DD HH:mm:ss} [{level}] {message} | {file} {line}",
         rotation="1 day",
@@ -0,0 +1,190 @@
+# lookup.py - 验证热路径的数据查询（带结果缓存、可选微批处理）
+
+import os
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from batcher import Batcher
+from dbmodel import AlipayUser, Device, TgUser, get_session_local
+from shared.cache import MISSING, device_key, tg_user_key, token_key, verify_cache
+from bloom import negative_filter
+from snapshot import auth_snapshot
+
+
+# =======================
+# 批量查询（IN 查询，单条查询也走这里）
+# =======================
+async def load_users_by_token(
+    db: AsyncSession, tokens: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    """按 Token 批量查询支付宝账号，返回 {token: 行快照}"""
+    result = await db.execute(
+        select(
+            AlipayUser.token,
+            AlipayUser.alipay_id,
+            AlipayUser.device_id,
+            AlipayUser.device_ban,
+            AlipayUser.account_ban,
+        ).where(AlipayUser.token.in_(tokens))
+    )
+    return {
+        row.token: {
+            "alipay_id": row.alipay_id,
+            "device_id": row.device_id,
+            "device_ban": row.device_ban,
+            "account_ban": row.account_ban,
+        }
+        for row in result
+    }
+
+
+async def load_device_owners(
+    db: AsyncSession, device_ids: List[str]
+) -> Dict[str, tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """按设备ID批量查询设备及其绑定的TG用户（一次 LEFT JOIN），返回 {device_id: (设备快照, TG用户快照)}"""
+    result = await db.execute(
+        select(
+            Device.device_id,
+            Device.tg_id,
+            TgUser.id,
+            TgUser.username,
+            TgUser.first_name,
+            TgUser.last_name,
+        )
+        .outerjoin(Device.tg_user)
+        .where(Device.device_id.in_(device_ids))
+    )
+    return {
+        row.device_id: (
+            {"tg_id": row.tg_id},
+            (
+                {
+                    "username": row.username,
+                    "first_name": row.first_name,
+                    "last_name": row.last_name,
+                }
+                if row.id is not None
+                else None
+            ),
+        )
+        for row in result
+    }
+
+
+# =======================
+# 微批处理（VERIFY_BATCH=true 开启）
+# =======================
+def _with_own_session(loader):
+    # 一个批次跨越多个请求，使用独立的会话
+    async def load_many(keys: List[str]):
+        async with get_session_local()() as session:
+            return await loader(session, keys)
+
+    return load_many
+
+
+_token_batcher: Optional[Batcher] = None
+_device_batcher: Optional[Batcher] = None
+if os.getenv("VERIFY_BATCH", "False").lower() in ("true", "1", "t"):
+    _window = float(os.getenv("VERIFY_BATCH_WINDOW_MS", 2)) / 1000
+    _max_size = int(os.getenv("VERIFY_BATCH_MAX", 100))
+    _token_batcher = Batcher(_with_own_session(load_users_by_token), _window, _max_size)
+    _device_batcher = Batcher(_with_own_session(load_device_owners), _window, _max_size)
+
+
+def batch_stats() -> Optional[Dict[str, Any]]:
+    if _token_batcher is None:
+        return None
+    return {"token": _token_batcher.stats(), "device": _device_batcher.stats()}
+
+
+# =======================
+# 单条查询（先查内存快照，再查否定过滤器与缓存）
+# 否定过滤器判定不存在即返回，不访问缓存与数据库
+# =======================
+async def get_alipay_user_by_token(
+    db: AsyncSession, token: str
+) -> Optional[Dict[str, Any]]:
+    """按 Token 查询支付宝账号，返回行快照"""
+    if auth_snapshot is not None and auth_snapshot.loaded:
+        user = auth_snapshot.get_user_by_token(token)
+        if user is not None:
+            return user
+    if negative_filter is not None and not negative_filter.may_have_token(token):
+        return None
+
+    key = token_key(token)
+    cached = await verify_cache.get(key)
+    if cached is not None:
+        snapshot = None if cached == MISSING else cached
+    else:
+        if _token_batcher is not None:
+            snapshot = await _token_batcher.load(token)
+        else:
+            snapshot = (await load_users_by_token(db, [token])).get(token)
+        await verify_cache.set(key, snapshot or MISSING)
+    if snapshot is None and negative_filter is not None:
+        negative_filter.record_miss("token")
+    return snapshot
+
+
+async def get_device_owner(
+    db: AsyncSession, device_id: str
+) -> tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    按设备ID查询设备及其绑定的TG用户，返回 (设备快照, TG用户快照)
+    缓存未命中时以一次 LEFT JOIN 同时取回两者
+    """
+    if auth_snapshot is not None and auth_snapshot.loaded:
+        found = auth_snapshot.get_device_owner(device_id)
+        if found is not None:
+            return found
+    if negative_filter is not None and not negative_filter.may_have_device(device_id):
+        return None, None
+
+    cached = await verify_cache.get(device_key(device_id))
+    if cached == MISSING:
+        if negative_filter is not None:
+            negative_filter.record_miss("device")
+        return None, None
+    if cached is not None:
+        return cached, await get_tg_user(db, cached["tg_id"])
+
+    if _device_batcher is not None:
+        found = await _device_batcher.load(device_id)
+    else:
+        found = (await load_device_owners(db, [device_id])).get(device_id)
+    if found is None:
+        await verify_cache.set(device_key(device_id), MISSING)
+        if negative_filter is not None:
+            negative_filter.record_miss("device")
+        return None, None
+
+    device, tg_user = found
+    await verify_cache.set(device_key(device_id), device)
+    await verify_cache.set(tg_user_key(device["tg_id"]), tg_user or MISSING)
+    return device, tg_user
+
+
+async def get_tg_user(db: AsyncSession, tg_id: int) -> Optional[Dict[str, Any]]:
+    """按TG ID查询TG用户，返回行快照"""
+    key = tg_user_key(tg_id)
+    cached = await verify_cache.get(key)
+    if cached is not None:
+        return None if cached == MISSING else cached
+
+    result = await db.execute(select(TgUser).where(TgUser.tg_id == tg_id))
+    tg_user = result.scalars().first()
+    snapshot = (
+        {
+            "username": tg_user.username,
+            "first_name": tg_user.first_name,
+            "last_name": tg_user.last_name,
+        }
+        if tg_user
+        else None
+    )
+    await verify_cache.set(key, snapshot or MISSING)
+    return snapshot
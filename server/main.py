@@ -1,20 +1,48 @@
+import asyncio
+import json
 import re
 import os
-from fastapi import FastAPI, Depends, HTTPException, Body, APIRouter
-from sqlalchemy.orm import Session
+from typing import Optional
+from fastapi import FastAPI, Depends, HTTPException, Body, APIRouter, Header, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
+from starlette.requests import Request
+from starlette.routing import Route
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import uuid4
-from log import configure_logging, logger
+from log import configure_logging, log_sampled, logger
 import time
 
-from dbmodel import AlipayUser, get_db, Device, TgUser
+from dbmodel import AlipayUser, get_db, get_engine, get_session_local
+from shared.cache import invalidate_tokens
+from shared.database import ensure_schema, get_pool_stats
+from lookup import (
+    batch_stats,
+    get_alipay_user_by_token,
+    get_device_owner,
+    load_device_owners,
+    load_users_by_token,
+)
 from webmodel import (
     EncryptedRequest,
     EncryptedResponse,
+    SecureVerifyBatchRequest,
+    SecureVerifyRequest,
+    VerifyBatchResponse,
     VerifyRequest,
     VerifyResponse,
     TokenRequest,
 )
-from RSAKeyManager import RSAKeyManager, decrypt_request
+from RSAKeyManager import MAX_DATA_LENGTH, RSAKeyManager, rejections
+from cryptopool import CryptoPool
+from codec import dump_response, load_request
+from metrics import metrics
+from ratelimit import RateLimitMiddleware, limiter_from_env
+from bodylimit import BodySizeLimitMiddleware
+from singleflight import SingleFlight
+from snapshot import auth_snapshot
+from bloom import negative_filter
 from dotenv import load_dotenv
 
 # 优先加载环境变量，确保后续代码能正确读取
@@ -25,15 +53,38 @@ configure_logging()
 
 # 全局变量
 rsa_manager: RSAKeyManager
+crypto_pool: CryptoPool
+# 公钥响应：(ETag, 除时间戳外预先序列化的响应体)，热加载时整体替换，两者始终对应同一把密钥
+public_key_response: tuple[str, bytes]
 
 # 调试路由
 debug_router = APIRouter()
 
+# Token 获取的并发合并（按 设备ID + 支付宝ID）
+token_flight = SingleFlight()
+
 
 async def lifespan(app: FastAPI):
     # 应用启动时执行
-    global rsa_manager
+    global rsa_manager, crypto_pool, public_key_response
+    await ensure_schema()
     rsa_manager = RSAKeyManager()
+    crypto_pool = CryptoPool(rsa_manager)
+    public_key_response = _build_public_key_response(rsa_manager)
+    reload_interval = float(os.getenv("KEYRING_RELOAD_INTERVAL", 30))
+    key_watcher = (
+        asyncio.create_task(_watch_keys(reload_interval))
+        if reload_interval > 0
+        else None
+    )
+    snapshot_refresher = None
+    if auth_snapshot is not None:
+        await auth_snapshot.load()
+        snapshot_refresher = asyncio.create_task(auth_snapshot.run())
+    filter_refresher = None
+    if negative_filter is not None:
+        await negative_filter.load()
+        filter_refresher = asyncio.create_task(negative_filter.run())
 
     # 根据环境变量决定是否加载调试接口
     if os.getenv("DEBUG_MODE", "False").lower() in ("true", "1", "t"):
@@ -43,7 +94,15 @@ async def lifespan(app: FastAPI):
         logger.success("调试模式已关闭 ✅")
 
     yield
-    # 可选：应用关闭时执行
+    # 应用关闭时执行：停止工作池并归还数据库连接
+    if key_watcher is not None:
+        key_watcher.cancel()
+    if snapshot_refresher is not None:
+        snapshot_refresher.cancel()
+    if filter_refresher is not None:
+        filter_refresher.cancel()
+    crypto_pool.shutdown()
+    await get_engine().dispose()
 
 
 app = FastAPI(
@@ -53,126 +112,249 @@ app = FastAPI(
 )
 app.description = "芝麻粒-TK授权码获取接口"
 
+# 请求体大小：解析 JSON 之前按 Content-Length 拦截（默认为 data 字段上限加其余字段的余量）
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_body=int(os.getenv("MAX_REQUEST_BODY", 0) or MAX_DATA_LENGTH + 4096),
+    paths=("/api/secure/verify", "/api/secure/verify_batch", "/api/secure/token"),
+)
+
+# 限流：按 IP 在中间件中拦截（不读取请求体、不解密），按设备ID在解密后拦截
+ip_limiter = limiter_from_env("IP")
+device_limiter = limiter_from_env("DEVICE")
+if ip_limiter is not None:
+    app.add_middleware(
+        RateLimitMiddleware,
+        limiter=ip_limiter,
+        paths=("/api/secure/verify", "/api/secure/verify_batch", "/api/secure/token"),
+        trust_proxy=os.getenv("RATE_LIMIT_TRUST_PROXY", "False").lower()
+        in ("true", "1", "t"),
+        trusted_hops=int(os.getenv("RATE_LIMIT_TRUSTED_HOPS", 1)),
+    )
+
 
 # =======================
 # 核心业务逻辑
 # =======================
-def _verify_logic(
-    verify_request: VerifyRequest, db: Session, authorization: str = None
+async def _verify_logic(
+    verify_request: VerifyRequest, db: AsyncSession, authorization: str = None
 ) -> VerifyResponse:
     """核心验证逻辑"""
     # ========== 1. 高级验证（带Token） ==========
     if authorization:
-        if not authorization.startswith("Bearer "):
-            logger.warning(
-                f"非法请求：[Token格式错误] | Authorization: {authorization}"
-            )
-            return VerifyResponse(
-                status=202, message="Token格式不正确，必须以Bearer开头"
-            )
+        token, error = _parse_authorization(authorization)
+        if error:
+            return error
+        user = await get_alipay_user_by_token(db, token)
+        return _check_token_user(verify_request, token, user)
 
-        token = authorization.replace("Bearer ", "").strip()
-        if not token:
-            logger.warning(f"非法请求：[Token为空]")
-            return VerifyResponse(status=203, message="Token不能为空")
+    # ========== 2. 基础验证（无Token） ==========
+    device, tg_user = await get_device_owner(db, verify_request.device_id)
+    return _check_device_owner(device, tg_user)
+
+
+async def _verify_batch_logic(
+    batch: SecureVerifyBatchRequest, db: AsyncSession
+) -> VerifyBatchResponse:
+    """
+    批量验证：带Token的条目以一次 Token IN 查询取回，其余条目以一次设备ID IN 查询取回，
+    逐条判定规则与 _verify_logic 相同（不经过单条查询的缓存）
+    """
+    results: list[Optional[VerifyResponse]] = [None] * len(batch.items)
+    tokens: dict[int, str] = {}
+    for i, item in enumerate(batch.items):
+        if item.authorization:
+            token, error = _parse_authorization(item.authorization)
+            if error:
+                results[i] = error
+            else:
+                tokens[i] = token
+
+    device_ids = {
+        item.device_id
+        for i, item in enumerate(batch.items)
+        if results[i] is None and i not in tokens and item.device_id
+    }
+    users = await load_users_by_token(db, list(set(tokens.values()))) if tokens else {}
+    owners = await load_device_owners(db, list(device_ids)) if device_ids else {}
+
+    for i, item in enumerate(batch.items):
+        if results[i] is not None:
+            continue
+        if i in tokens:
+            results[i] = _check_token_user(item, tokens[i], users.get(tokens[i]))
+        else:
+            results[i] = _check_device_owner(*owners.get(item.device_id, (None, None)))
+    return VerifyBatchResponse(status=100, message="批量验证完成", results=results)
+
+
+def _parse_authorization(
+    authorization: str,
+) -> tuple[Optional[str], Optional[VerifyResponse]]:
+    """解析 Bearer Token，返回 (token, 错误响应)"""
+    if not authorization.startswith("Bearer "):
+        logger.warning(
+            "非法请求：[Token格式错误] | Authorization: {authorization}",
+            authorization=authorization,
+        )
+        return None, VerifyResponse(
+            status=202, message="Token格式不正确，必须以Bearer开头"
+        )
 
-        user = db.query(AlipayUser).filter(AlipayUser.token == token).first()
-        if not user:
-            logger.warning(f"非法请求：[无效Token] | Token: {token}")
-            return VerifyResponse(status=204, message="无效Token")
+    token = authorization.replace("Bearer ", "").strip()
+    if not token:
+        logger.warning("非法请求：[Token为空]")
+        return None, VerifyResponse(status=203, message="Token不能为空")
+    return token, None
 
-        if user.device_id != verify_request.device_id:
-            logger.warning(f"非法请求：[设备ID不匹配] | 数据库设备ID: {user.device_id}")
-            return VerifyResponse(status=205, message="设备ID不匹配")
 
-        if getattr(user, "device_ban", 0) == 1:
-            logger.warning(
-                f"设备被禁用请求：[设备已被禁用] | 设备ID: {verify_request.device_id}"
-            )
-            return VerifyResponse(status=300, message="设备已被禁用")
+def _check_token_user(
+    verify_request: VerifyRequest, token: str, user: Optional[dict]
+) -> VerifyResponse:
+    """高级验证：按 Token 查到的账号快照判定"""
+    if not user:
+        logger.warning("非法请求：[无效Token] | Token: {token}", token=token)
+        return VerifyResponse(status=204, message="无效Token")
 
-        if getattr(user, "account_ban", 0) == 1:
-            logger.warning(
-                f"账号被禁用请求：[账号已被禁用] | 支付宝ID: {user.alipay_id}"
-            )
-            return VerifyResponse(status=400, message="账号已被禁用")
+    if user["device_id"] != verify_request.device_id:
+        logger.warning(
+            "非法请求：[设备ID不匹配] | 数据库设备ID: {device_id}",
+            device_id=user["device_id"],
+        )
+        return VerifyResponse(status=205, message="设备ID不匹配")
 
-        if verify_request.alipay_id and verify_request.alipay_id != user.alipay_id:
-            logger.warning(f"非法请求：[账号不匹配] | 数据库账号: {user.alipay_id}")
-            return VerifyResponse(status=207, message="账号不匹配")
+    if user["device_ban"] == 1:
+        logger.warning(
+            "设备被禁用请求：[设备已被禁用] | 设备ID: {device_id}",
+            device_id=verify_request.device_id,
+        )
+        return VerifyResponse(status=300, message="设备已被禁用")
 
-        logger.info(
-            f"高级验证成功：[设备ID: {verify_request.device_id} | 支付宝ID: {user.alipay_id}]"
+    if user["account_ban"] == 1:
+        logger.warning(
+            "账号被禁用请求：[账号已被禁用] | 支付宝ID: {alipay_id}",
+            alipay_id=user["alipay_id"],
         )
-        return VerifyResponse(
-            status=100,
-            message="验证成功",
-            token=token,
-            data={"alipay_id": user.alipay_id},
+        return VerifyResponse(status=400, message="账号已被禁用")
+
+    if verify_request.alipay_id and verify_request.alipay_id != user["alipay_id"]:
+        logger.warning(
+            "非法请求：[账号不匹配] | 数据库账号: {alipay_id}",
+            alipay_id=user["alipay_id"],
         )
+        return VerifyResponse(status=207, message="账号不匹配")
 
-    # ========== 2. 基础验证（无Token） ==========
-    else:
-        device = (
-            db.query(Device)
-            .filter(Device.device_id == verify_request.device_id)
-            .first()
+    if log_sampled():
+        logger.info(
+            "高级验证成功：[设备ID: {device_id} | 支付宝ID: {alipay_id}]",
+            device_id=verify_request.device_id,
+            alipay_id=user["alipay_id"],
         )
-        if not device:
-            return VerifyResponse(status=208, message="请在tg机器人处绑定Verify ID")
+    return VerifyResponse(
+        status=100,
+        message="验证成功",
+        token=token,
+        data={"alipay_id": user["alipay_id"]},
+    )
 
-        tg_user = db.query(TgUser).filter(TgUser.tg_id == device.tg_id).first()
-        if not tg_user:
-            return VerifyResponse(
-                status=210, message="设备绑定的TG用户不存在 在机器人处执行/sync 绑定"
-            )
 
-        uname = (
-            f"@{tg_user.username}"
-            if tg_user.username
-            else f"@{tg_user.first_name or ''} {tg_user.last_name or ''}".strip()
-        )
+def _check_device_owner(
+    device: Optional[dict], tg_user: Optional[dict]
+) -> VerifyResponse:
+    """基础验证：按设备ID查到的设备与TG用户快照判定"""
+    if not device:
+        return VerifyResponse(status=208, message="请在tg机器人处绑定Verify ID")
+
+    if not tg_user:
         return VerifyResponse(
-            status=101, message=f"{uname} 欢迎使用!", data={"user": uname}
+            status=210, message="设备绑定的TG用户不存在 在机器人处执行/sync 绑定"
         )
 
+    uname = (
+        f"@{tg_user['username']}"
+        if tg_user["username"]
+        else f"@{tg_user['first_name'] or ''} {tg_user['last_name'] or ''}".strip()
+    )
+    return VerifyResponse(
+        status=101, message=f"{uname} 欢迎使用!", data={"user": uname}
+    )
+
 
-def _get_token_logic(token_request: TokenRequest, db: Session) -> VerifyResponse:
-    """核心获取Token逻辑"""
+async def _get_token_logic(token_request: TokenRequest) -> VerifyResponse:
+    """核心获取Token逻辑（_issue_token 使用自己的数据库会话，不需要请求级会话）"""
     if not re.match(r"^[a-zA-Z0-9\-_]{8,64}$", token_request.device_id):
         return VerifyResponse(status=212, message="设备ID格式不正确")
     if not re.match(r"^\d{16}$", token_request.alipay_id):
         return VerifyResponse(status=213, message="支付宝ID必须是16位数字")
 
-    user = (
-        db.query(AlipayUser)
-        .filter(
-            AlipayUser.device_id == token_request.device_id,
-            AlipayUser.alipay_id == token_request.alipay_id,
-        )
-        .first()
+    # 同一 (设备ID, 支付宝ID) 的并发请求共享一次查询与一次提交
+    return await token_flight.do(
+        (token_request.device_id, token_request.alipay_id),
+        lambda: _issue_token(token_request.device_id, token_request.alipay_id),
     )
-    if not user:
-        return VerifyResponse(status=214, message="设备与支付宝账号不匹配")
-    if getattr(user, "device_ban", 0) == 1:
-        return VerifyResponse(status=300, message="设备已被禁用")
-    if getattr(user, "account_ban", 0) == 1:
-        return VerifyResponse(status=400, message="账号已被禁用")
 
-    if not user.token:
-        user.token = str(uuid4().hex)
-        db.commit()
-        logger.info(
-            f"Token生成成功：[设备ID: {token_request.device_id} | 支付宝ID: {token_request.alipay_id}]"
+
+async def _issue_token(device_id: str, alipay_id: str) -> VerifyResponse:
+    """
+    查询账号并在没有 Token 时生成
+    由 token_flight 以独立任务执行，使用自己的数据库会话；
+    Token 以 UPDATE ... WHERE token IS NULL 写入，多进程/多实例并发时由数据库决定唯一的 Token
+    """
+    async with get_session_local()() as db:
+        result = await db.execute(
+            select(
+                AlipayUser.id,
+                AlipayUser.alipay_id,
+                AlipayUser.token,
+                AlipayUser.device_ban,
+                AlipayUser.account_ban,
+            ).where(
+                AlipayUser.device_id == device_id,
+                AlipayUser.alipay_id == alipay_id,
+            )
         )
+        user = result.first()
+        if not user:
+            return VerifyResponse(status=214, message="设备与支付宝账号不匹配")
+        if user.device_ban == 1:
+            return VerifyResponse(status=300, message="设备已被禁用")
+        if user.account_ban == 1:
+            return VerifyResponse(status=400, message="账号已被禁用")
 
-    logger.info(
-        f"Token发放成功：[设备ID: {token_request.device_id} | 支付宝ID: {token_request.alipay_id}]"
-    )
+        token = user.token
+        if not token:
+            token = uuid4().hex
+            result = await db.execute(
+                update(AlipayUser)
+                .where(AlipayUser.id == user.id, AlipayUser.token.is_(None))
+                .values(token=token)
+            )
+            await db.commit()
+            if result.rowcount == 1:
+                await invalidate_tokens(token)
+                if negative_filter is not None:
+                    negative_filter.add_token(token)
+                logger.info(
+                    "Token生成成功：[设备ID: {device_id} | 支付宝ID: {alipay_id}]",
+                    device_id=device_id,
+                    alipay_id=alipay_id,
+                )
+            else:
+                # 其他进程抢先写入，使用数据库中的 Token
+                token = await db.scalar(
+                    select(AlipayUser.token).where(AlipayUser.id == user.id)
+                )
+
+    if log_sampled():
+        logger.info(
+            "Token发放成功：[设备ID: {device_id} | 支付宝ID: {alipay_id}]",
+            device_id=device_id,
+            alipay_id=alipay_id,
+        )
     return VerifyResponse(
         status=100,
         message="Token获取成功",
-        token=user.token,
+        token=token,
         data={"alipay_id": user.alipay_id},
     )
 
@@ -180,69 +362,303 @@ def _get_token_logic(token_request: TokenRequest, db: Session) -> VerifyResponse
 # =======================
 # Public API
 # =======================
-@app.post("/api/public_key")
-async def get_public_key():
-    """获取服务端公钥，用于Xposed模块初始化"""
-    return {
-        "status": 100,
-        "message": "公钥获取成功",
-        "public_key": rsa_manager.get_public_key_pem(),
-        "timestamp": int(time.time()),
+PUBLIC_KEY_MAX_AGE = int(os.getenv("PUBLIC_KEY_MAX_AGE", 3600))
+
+
+async def _device_limited(*device_ids: Optional[str]) -> bool:
+    """按设备ID限流（批量请求中的每个设备ID各计一次），任一超限返回 True"""
+    if device_limiter is None:
+        return False
+    for device_id in device_ids:
+        if device_id and not await device_limiter.allow(device_id):
+            return True
+    return False
+
+
+async def _watch_keys(interval: float):
+    """定期检查密钥文件，有变化时热加载密钥环并刷新公钥响应"""
+    global public_key_response
+    while True:
+        await asyncio.sleep(interval)
+        # 读取密钥文件在线程中完成，不阻塞事件循环；热加载从不生成密钥
+        # 线程结束后才在事件循环中重建响应，请求不会拿到新 ETag 配旧公钥
+        if await asyncio.to_thread(rsa_manager.reload_if_changed):
+            public_key_response = _build_public_key_response(rsa_manager)
+
+
+def _build_public_key_response(manager: RSAKeyManager) -> tuple[str, bytes]:
+    """预先序列化公钥响应体（除时间戳外），请求时只需拼接当前时间戳；返回 (ETag, 响应体前缀)"""
+    body = json.dumps(
+        {
+            "status": 100,
+            "message": "公钥获取成功",
+            "public_key": manager.public_key_pem,
+            "public_key_der": manager.public_key_der_b64,
+            "fingerprint": manager.fingerprint,
+            "kid": manager.kid,
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return manager.etag, (body[:-1] + ',"timestamp":').encode("utf-8")
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 按弱比较匹配（忽略 W/ 前缀）"""
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+@app.api_route("/api/public_key", methods=["GET", "POST"])
+async def get_public_key(if_none_match: Optional[str] = Header(None)):
+    """获取服务端公钥，用于Xposed模块初始化（支持 ETag / If-None-Match）"""
+    etag, body_prefix = public_key_response
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={PUBLIC_KEY_MAX_AGE}",
     }
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=body_prefix + str(int(time.time())).encode() + b"}",
+        media_type="application/json",
+        headers=headers,
+    )
 
 
 # =======================
 # Secure API
 # =======================
-@app.post("/api/secure/verify", response_model=EncryptedResponse)
-async def secure_verify(
-    encrypted_request: EncryptedRequest, db: Session = Depends(get_db)
-):
-    """安全验证API（处理加密请求并返回加密响应）"""
+async def _secure_call(
+    path: str,
+    action: str,
+    encrypted_request: EncryptedRequest,
+    db: Optional[AsyncSession],
+    model,
+    logic,
+) -> dict:
+    """安全接口公共流程：解密 -> 限流 -> 业务逻辑 -> 加密，返回加密后的响应字典"""
     aes_key = None
     try:
-        request_data, aes_key = decrypt_request(encrypted_request, rsa_manager)
-        verify_request = VerifyRequest(**request_data)
-        authorization = request_data.get("authorization")
-        response = _verify_logic(verify_request, db, authorization)
-        return rsa_manager.encrypt_response(
-            response.model_dump(exclude_none=True), aes_key
+        plaintext, aes_key = await crypto_pool.decrypt_request(encrypted_request)
+        request = load_request(model, plaintext, encrypted_request.fmt)
+        device_ids = (
+            request.device_ids
+            if isinstance(request, SecureVerifyBatchRequest)
+            else (request.device_id,)
         )
+        if await _device_limited(*device_ids):
+            response = VerifyResponse(status=429, message="请求过于频繁，请稍后再试")
+        else:
+            start = time.perf_counter()
+            response = await logic(request, db)
+            metrics.observe("db_lookup", time.perf_counter() - start)
+        metrics.count_request(path, response.status)
+        return await crypto_pool.encrypt_response(
+            dump_response(response, encrypted_request.fmt),
+            aes_key,
+            crypto_pool.session_id(encrypted_request),
+        )
+    except HTTPException as e:
+        # 校验、重放、kid、会话、工作池与解密的拒绝：已在各自阶段记录，保留原状态码
+        metrics.count_request(path, e.status_code)
+        raise
     except Exception as e:
         logger.error(
-            f"安全验证过程中发生错误: {str(e)} | 请求: {encrypted_request.model_dump_json()}"
+            "{action}过程中发生错误: {error} | 请求: [ts: {ts} | sig: {sig}]",
+            action=action,
+            error=str(e),
+            ts=encrypted_request.ts,
+            sig=encrypted_request.sig[:16],
         )
         if aes_key:
+            metrics.count_request(path, 500)
             response = VerifyResponse(status=500, message="服务器内部错误")
-            return rsa_manager.encrypt_response(
-                response.model_dump(exclude_none=True), aes_key
+            return await crypto_pool.encrypt_response(
+                dump_response(response, encrypted_request.fmt), aes_key
             )
+        metrics.count_request(path, 400)
         raise HTTPException(status_code=400, detail="请求处理失败，无法加密响应")
 
 
-@app.post("/api/secure/token", response_model=EncryptedResponse)
-async def secure_get_token(
-    encrypted_request: EncryptedRequest, db: Session = Depends(get_db)
+async def _secure_verify(encrypted_request: EncryptedRequest, db: AsyncSession):
+    return await _secure_call(
+        "/api/secure/verify",
+        "安全验证",
+        encrypted_request,
+        db,
+        SecureVerifyRequest,
+        lambda request, db: _verify_logic(request, db, request.authorization),
+    )
+
+
+async def _secure_verify_batch(encrypted_request: EncryptedRequest, db: AsyncSession):
+    return await _secure_call(
+        "/api/secure/verify_batch",
+        "安全批量验证",
+        encrypted_request,
+        db,
+        SecureVerifyBatchRequest,
+        _verify_batch_logic,
+    )
+
+
+async def _secure_get_token(
+    encrypted_request: EncryptedRequest, db: Optional[AsyncSession] = None
+):
+    # db 仅为与其他安全接口的处理函数签名一致（精简路由统一传入），Token 获取不使用
+    return await _secure_call(
+        "/api/secure/token",
+        "安全Token获取",
+        encrypted_request,
+        db,
+        TokenRequest,
+        lambda request, _: _get_token_logic(request),
+    )
+
+
+@app.post(
+    "/api/secure/verify",
+    response_model=EncryptedResponse,
+    response_model_exclude_none=True,
+)
+async def secure_verify(
+    encrypted_request: EncryptedRequest, db: AsyncSession = Depends(get_db)
 ):
+    """安全验证API（处理加密请求并返回加密响应）"""
+    return await _secure_verify(encrypted_request, db)
+
+
+@app.post(
+    "/api/secure/verify_batch",
+    response_model=EncryptedResponse,
+    response_model_exclude_none=True,
+)
+async def secure_verify_batch(
+    encrypted_request: EncryptedRequest, db: AsyncSession = Depends(get_db)
+):
+    """安全批量验证API（一个加密信封内验证多个账号，返回逐条结果）"""
+    return await _secure_verify_batch(encrypted_request, db)
+
+
+@app.post(
+    "/api/secure/token",
+    response_model=EncryptedResponse,
+    response_model_exclude_none=True,
+)
+async def secure_get_token(encrypted_request: EncryptedRequest):
     """安全获取Token API（处理加密请求并返回加密响应）"""
-    aes_key = None
-    try:
-        request_data, aes_key = decrypt_request(encrypted_request, rsa_manager)
-        token_request = TokenRequest(**request_data)
-        response = _get_token_logic(token_request, db)
-        return rsa_manager.encrypt_response(
-            response.model_dump(exclude_none=True), aes_key
+    return await _secure_get_token(encrypted_request)
+
+
+def _lean_route(secure_handler):
+    """
+    精简路由：不经过 FastAPI 的依赖注入与 response_model 校验，
+    请求体只解析一次，响应字典（均为 base64/十六进制字符串）直接编码为字节
+    """
+
+    async def endpoint(request: Request) -> Response:
+        try:
+            encrypted_request = EncryptedRequest.model_validate_json(
+                await request.body()
+            )
+        except ValidationError:
+            raise HTTPException(status_code=422, detail="请求格式不正确")
+        async with get_session_local()() as db:
+            encrypted = await secure_handler(encrypted_request, db)
+        return Response(
+            content=json.dumps(encrypted).encode(), media_type="application/json"
         )
-    except Exception as e:
-        logger.error(
-            f"安全Token获取过程中发生错误: {str(e)} | 请求: {encrypted_request.model_dump_json()}"
+
+    return endpoint
+
+
+# 开启后精简路由插入到路由表最前，优先于上面的 FastAPI 路由匹配（接口文档仍由后者生成）
+if os.getenv("SECURE_LEAN_ROUTES", "False").lower() in ("true", "1", "t"):
+    for path, secure_handler in (
+        ("/api/secure/verify", _secure_verify),
+        ("/api/secure/verify_batch", _secure_verify_batch),
+        ("/api/secure/token", _secure_get_token),
+    ):
+        app.router.routes.insert(
+            0, Route(path, _lean_route(secure_handler), methods=["POST"])
         )
-        if aes_key:
-            response = VerifyResponse(status=500, message="服务器内部错误")
-            return rsa_manager.encrypt_response(
-                response.model_dump(exclude_none=True), aes_key
-            )
-        raise HTTPException(status_code=400, detail="请求处理失败，无法加密响应")
+
+
+def _db_pool_connections():
+    stats = get_pool_stats()
+    return [
+        ({"state": state}, stats[state])
+        for state in ("size", "checked_in", "checked_out", "overflow")
+        if state in stats
+    ]
+
+
+# 连接池指标（与 /api/debug/db_pool 相同的数据，不需开启 DEBUG_MODE）
+metrics.register(
+    "sesame_db_pool_connections",
+    "gauge",
+    "数据库连接池连接数（size 为池大小，checked_out 为使用中）",
+    _db_pool_connections,
+)
+metrics.register(
+    "sesame_db_pool_wait_seconds_total",
+    "counter",
+    "借出连接的累计等待时间（秒）",
+    lambda: [({}, get_pool_stats()["wait_total_ms"] / 1000)],
+)
+metrics.register(
+    "sesame_db_pool_waits_total",
+    "counter",
+    "借出连接次数",
+    lambda: [({}, get_pool_stats()["wait_count"])],
+)
+metrics.register(
+    "sesame_db_pool_timeouts_total",
+    "counter",
+    "借出连接超时次数",
+    lambda: [({}, get_pool_stats()["timeouts"])],
+)
+
+# 加解密工作池指标（与 /api/debug/crypto_pool 相同的数据）
+metrics.register(
+    "sesame_crypto_pool_queue_depth",
+    "gauge",
+    "加解密工作池排队与执行中的任务数（上限为 CRYPTO_POOL_MAX_PENDING）",
+    lambda: [({}, crypto_pool.stats()["queue_depth"])],
+)
+metrics.register(
+    "sesame_crypto_pool_jobs_total",
+    "counter",
+    "加解密工作池任务数（completed 完成 / failed 失败 / rejected 排队已满被拒绝）",
+    lambda: [
+        ({"result": result}, crypto_pool.stats()[result])
+        for result in ("completed", "failed", "rejected")
+    ],
+)
+
+# 廉价校验各阶段的拒绝次数（kid 为密钥环中不存在的 kid）
+metrics.register(
+    "sesame_rejections_total",
+    "counter",
+    "解密前被拒绝的请求数（按校验阶段）",
+    lambda: [
+        ({"stage": stage}, rejections[stage])
+        for stage in ("size", "expired", "shape", "signature", "kid")
+    ],
+)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus 文本格式指标"""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 # =======================
@@ -251,17 +667,68 @@ async def secure_get_token(
 @debug_router.post("/verify", response_model=VerifyResponse)
 async def debug_verify(
     verify_request: VerifyRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     authorization: str = Body(None, embed=True),
 ):
     """调试验证API（处理明文请求并返回明文响应）"""
-    return _verify_logic(verify_request, db, authorization)
+    return await _verify_logic(verify_request, db, authorization)
 
 
 @debug_router.post("/token", response_model=VerifyResponse)
-async def debug_get_token(token_request: TokenRequest, db: Session = Depends(get_db)):
+async def debug_get_token(token_request: TokenRequest):
     """调试获取Token API（处理明文请求并返回明文响应）"""
-    return _get_token_logic(token_request, db)
+    return await _get_token_logic(token_request)
+
+
+@debug_router.get("/crypto_pool")
+async def debug_crypto_pool():
+    """加解密工作池指标（排队深度等）"""
+    return crypto_pool.stats()
+
+
+@debug_router.get("/db_pool")
+async def debug_db_pool():
+    """数据库连接池指标（使用中连接数、借出等待时间）"""
+    return get_pool_stats()
+
+
+@debug_router.get("/rate_limit")
+async def debug_rate_limit():
+    """查看限流器统计"""
+    return {
+        "ip": ip_limiter.stats() if ip_limiter else None,
+        "device": device_limiter.stats() if device_limiter else None,
+    }
+
+
+@debug_router.get("/keyring")
+async def debug_keyring():
+    """查看密钥环：主密钥 kid 与全部可用 kid"""
+    return {"primary": rsa_manager.kid, "kids": list(rsa_manager.keys)}
+
+
+@debug_router.get("/verify_batch")
+async def debug_verify_batch():
+    """验证查询微批处理指标（批次数、平均批大小）"""
+    return batch_stats()
+
+
+@debug_router.get("/snapshot")
+async def debug_snapshot():
+    """授权数据内存快照统计（条目数、命中率、增量刷新水位线）"""
+    return auth_snapshot.stats() if auth_snapshot else None
+
+
+@debug_router.get("/token_flight")
+async def debug_token_flight():
+    """Token 获取并发合并统计（执行次数、共享结果次数）"""
+    return token_flight.stats()
+
+
+@debug_router.get("/negative_filter")
+async def debug_negative_filter():
+    """否定查询过滤器统计（内存占用、估算与实际误判率）"""
+    return negative_filter.stats() if negative_filter else None
 
 
 # =======================
@@ -272,20 +739,99 @@ async def ping():
     return {"status": "ok"}
 
 
+def _prepare_workers():
+    """多 worker 启动前在主进程完成一次迁移与密钥生成，避免各 worker 同时执行"""
+
+    async def prepare():
+        await ensure_schema()
+        await get_engine().dispose()
+
+    asyncio.run(prepare())
+    RSAKeyManager()
+
+
+def _check_worker_state(workers: int):
+    """
+    多 worker 时各进程的内存状态互不可见：
+    - 重放检测与限流使用进程内存储时，保护会被静默削弱（重放请求换一个 worker 即可通过，
+      限流额度变为 worker 数倍），默认拒绝启动，需改用共享后端或显式设置 SERVER_ALLOW_LOCAL_STATE=true
+    - 会话复用、授权快照、否定查询过滤器、/metrics 为每个 worker 各一份，只影响命中率与指标，仅提示
+    """
+    if workers <= 1:
+        return
+    weakened = []
+    if (
+        os.getenv("REPLAY_GUARD", "True").lower() in ("true", "1", "t")
+        and os.getenv("REPLAY_STORE", "memory") == "memory"
+    ):
+        weakened.append("重放检测（REPLAY_STORE=memory）")
+    if (ip_limiter or device_limiter) and os.getenv(
+        "RATE_LIMIT_BACKEND", "memory"
+    ) == "memory":
+        weakened.append("限流（RATE_LIMIT_BACKEND=memory）")
+    if weakened:
+        message = (
+            f"{workers} 个 worker 下以下保护仅在单个进程内生效：{'、'.join(weakened)}，"
+            "请配置共享后端（如 redis://）"
+        )
+        if os.getenv("SERVER_ALLOW_LOCAL_STATE", "False").lower() not in (
+            "true",
+            "1",
+            "t",
+        ):
+            raise SystemExit(f"{message}，或设置 SERVER_ALLOW_LOCAL_STATE=true 后启动")
+        logger.warning("⚠️ " + message)
+    logger.warning(
+        "多 worker 模式：会话复用、授权快照、否定查询过滤器与 /metrics 指标为每个 worker 各一份"
+    )
+
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="芝麻粒-TK授权码获取接口")
+    parser.add_argument(
+        "--prod",
+        action="store_true",
+        default=os.getenv("SERVER_MODE", "dev").lower() == "prod",
+        help="生产模式：多 worker、关闭热重载（也可设置 SERVER_MODE=prod）",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("SERVER_WORKERS", 0) or os.cpu_count() or 1),
+        help="生产模式下的 worker 进程数，默认 CPU 核数",
+    )
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", 8008)))
+    args = parser.parse_args()
+
     try:
         import uvicorn
 
-        uvicorn.run(
-            "main:app",
-            host="0.0.0.0",
-            port=8008,
-            reload=True,
-            reload_dirs=[
-                "./server",
-                "./shared",
-                # "./src",
-            ],  # 只监控关键源代码目录
-        )
+        if args.prod:
+            _check_worker_state(args.workers)
+            _prepare_workers()
+            logger.info(f"生产模式启动：[worker 数: {args.workers}]")
+            uvicorn.run(
+                "main:app",
+                host=args.host,
+                port=args.port,
+                workers=args.workers,
+                reload=False,
+                timeout_graceful_shutdown=int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30)),
+            )
+        else:
+            uvicorn.run(
+                "main:app",
+                host=args.host,
+                port=args.port,
+                reload=True,
+                reload_dirs=[
+                    "./server",
+                    "./shared",
+                    # "./src",
+                ],  # 只监控关键源代码目录
+            )
     except ImportError:
         logger.info("缺少 uvicorn 依赖，请运行 'pip install uvicorn'")
@@ -0,0 +1,116 @@
+# metrics.py - Prometheus 文本格式指标（请求计数 + 分阶段延迟直方图 + 输出时读取的 gauge / counter）
+
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Dict, Iterable
+
+# 直方图桶上限（秒）：覆盖从 HMAC 校验（微秒级）到慢查询（秒级）
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+STAGES = ("signature", "rsa_unwrap", "aes_decrypt", "db_lookup", "aes_encrypt")
+"安全请求的处理阶段：签名校验、RSA解包、AES解密、数据库查询、AES加密"
+
+
+class Histogram:
+    """固定桶直方图，observe 为 O(log 桶数)"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    进程内指标
+    - requests: (接口, 状态码) -> 次数；状态码为 VerifyResponse.status，未能加密响应时为 HTTP 状态码
+    - stages: 阶段名 -> 延迟直方图（秒）
+    - collectors: 由 register() 注册、输出时才读取的指标（连接池、工作池等已有统计）
+    多 worker 部署时每个进程各自统计
+    """
+
+    def __init__(self):
+        self.requests: Counter = Counter()
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.collectors: list[tuple[str, str, str, Callable]] = []
+
+    def register(
+        self,
+        name: str,
+        kind: str,
+        help: str,
+        collect: Callable[[], Iterable[tuple[Dict[str, str], float]]],
+    ):
+        """注册输出时读取的指标，kind 为 gauge / counter，collect 返回 [(标签, 值)]"""
+        self.collectors.append((name, kind, help, collect))
+
+    def count_request(self, endpoint: str, status: int):
+        self.requests[(endpoint, status)] += 1
+
+    def observe(self, stage: str, seconds: float):
+        self.stages[stage].observe(seconds)
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式（0.0.4）"""
+        lines = [
+            "# HELP sesame_requests_total 安全接口请求数（按接口与响应状态码）",
+            "# TYPE sesame_requests_total counter",
+        ]
+        for (endpoint, status), value in sorted(self.requests.items()):
+            lines.append(
+                f'sesame_requests_total{{endpoint="{endpoint}",status="{status}"}} {value}'
+            )
+
+        lines += [
+            "# HELP sesame_stage_seconds 安全请求各处理阶段耗时（秒）",
+            "# TYPE sesame_stage_seconds histogram",
+        ]
+        for stage, histogram in self.stages.items():
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'sesame_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'sesame_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}'
+            )
+            lines.append(
+                f'sesame_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}'
+            )
+            lines.append(
+                f'sesame_stage_seconds_count{{stage="{stage}"}} {histogram.count}'
+            )
+
+        for name, kind, help, collect in self.collectors:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            for labels, value in collect():
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(
+                    f"{name}{{{label_text}}} {value}" if labels else f"{name} {value}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,174 @@
+# ratelimit.py - 令牌桶限流（按 IP / 设备ID）
+
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucketLimiter:
+    """
+    进程内令牌桶：每个 key 以 rate 个/秒补充令牌，最多积攒 burst 个
+    key 数量超过 maxsize 时淘汰最久未访问的桶
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, list[float]]" = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    async def allow(self, key: str) -> bool:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed += 1
+            return True
+        self.limited += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class CashewsWindowLimiter:
+    """
+    共享后端限流（多进程/多实例共用，如 redis://）
+    以 burst / rate 秒为一个固定窗口、每窗口 burst 次近似令牌桶
+    """
+
+    def __init__(self, uri: str, rate: float, burst: int, prefix: str):
+        from cashews import Cache
+
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self.window = max(1, int(burst / rate))
+        self._cache = Cache()
+        self._cache.setup(uri)
+        self.allowed = 0
+        self.limited = 0
+
+    async def allow(self, key: str) -> bool:
+        slot = int(time.time()) // self.window
+        cache_key = f"{self.prefix}:{key}:{slot}"
+        count = await self._cache.incr(cache_key)
+        if count == 1:
+            await self._cache.expire(cache_key, self.window)
+        if count <= self.burst:
+            self.allowed += 1
+            return True
+        self.limited += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "backend": "cashews",
+            "rate": self.rate,
+            "burst": self.burst,
+            "window": self.window,
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+def limiter_from_env(name: str):
+    """
+    按环境变量创建限流器，未配置速率时返回 None（不限流）
+    - RATE_LIMIT_{NAME}_RATE: 每秒补充的令牌数
+    - RATE_LIMIT_{NAME}_BURST: 桶容量，默认为速率的 10 倍
+    - RATE_LIMIT_BACKEND: memory（默认）或 cashews 后端 URI
+    """
+    rate = float(os.getenv(f"RATE_LIMIT_{name}_RATE", 0))
+    if rate <= 0:
+        return None
+    burst = int(os.getenv(f"RATE_LIMIT_{name}_BURST", 0) or max(1, rate * 10))
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    if backend == "memory":
+        return TokenBucketLimiter(rate, burst)
+    return CashewsWindowLimiter(backend, rate, burst, prefix=f"rl:{name.lower()}")
+
+
+class RateLimitMiddleware:
+    """
+    按客户端 IP 限流的 ASGI 中间件，只作用于 paths 中的路径
+    超限时直接返回 429，不读取请求体，不进行任何解密
+    """
+
+    _BODY = json.dumps({"detail": "请求过于频繁，请稍后再试"}).encode()
+
+    def __init__(
+        self,
+        app,
+        limiter,
+        paths: tuple[str, ...],
+        trust_proxy: bool = False,
+        trusted_hops: int = 1,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.paths = paths
+        self.trust_proxy = trust_proxy
+        self.trusted_hops = max(1, trusted_hops)
+
+    def _client_ip(self, scope) -> Optional[str]:
+        """
+        信任代理时取 X-Forwarded-For 右起第 trusted_hops 项：
+        最左侧的项由客户端自行填写可被伪造，只有自己的代理追加在右侧的项可信
+        """
+        if self.trust_proxy:
+            hops = [
+                hop.strip()
+                for name, value in scope.get("headers", ())
+                if name == b"x-forwarded-for"
+                for hop in value.decode("latin-1").split(",")
+                if hop.strip()
+            ]
+            if len(hops) >= self.trusted_hops:
+                return hops[-self.trusted_hops]
+        client = scope.get("client")
+        return client[0] if client else None
+
+    async def __call__(self, scope, receive, send):
+        if (
+            self.limiter is None
+            or scope["type"] != "http"
+            or scope["path"] not in self.paths
+        ):
+            return await self.app(scope, receive, send)
+
+        ip = self._client_ip(scope)
+        if ip is not None and not await self.limiter.allow(ip):
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(self._BODY)).encode()),
+                        (b"retry-after", b"1"),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": self._BODY})
+            return
+        await self.app(scope, receive, send)
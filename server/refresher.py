@@ -0,0 +1,52 @@
+# refresher.py - 按 updated_at 增量刷新的内存索引（授权快照、否定查询过滤器共用）
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from log import logger
+
+
+class Refresher:
+    """
+    后台刷新循环：每 refresh_interval 秒调用 refresh() 增量刷新，每 full_interval 秒调用 load() 全量重建
+    子类实现 load() / refresh()，load() 完成后需设置 _last_full 与 loaded
+    """
+
+    name = "内存索引"
+
+    def __init__(self, refresh_interval: float, full_interval: float):
+        self.refresh_interval = refresh_interval
+        self.full_interval = full_interval
+        # updated_at 精度为秒且提交时间晚于写入时间，增量查询向前多取一段
+        self.overlap = timedelta(seconds=2)
+        self._watermark: Optional[datetime] = None
+        self._last_full = 0.0
+        self.loaded = False
+
+    async def load(self):
+        raise NotImplementedError
+
+    async def refresh(self):
+        raise NotImplementedError
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if time.monotonic() - self._last_full >= self.full_interval:
+                    await self.load()
+                else:
+                    await self.refresh()
+            except Exception as e:
+                logger.error("{name}刷新失败: {error}", name=self.name, error=str(e))
+
+
+def later(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    """两个可能为空的时间中较晚的一个"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
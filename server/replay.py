@@ -0,0 +1,130 @@
+# replay.py - 重放请求检测（按签名去重，时间分桶过期，内存有上限）
+
+import os
+import time
+from typing import Dict, Optional, Set
+
+
+class ReplayGuard:
+    """
+    记录窗口期内见过的请求签名，重复签名直接拒绝
+
+    - 按请求时间戳分桶（bucket 秒一桶），时间戳超出 window 的桶整体丢弃，
+      这些请求本身也会被时间戳校验拒绝
+    - 每条记录只保存签名的前 16 字节；总条数超过 max_entries 时淘汰最旧的桶
+    """
+
+    def __init__(self, window: int = 300, bucket: int = 30, max_entries: int = 200_000):
+        self.window = window
+        self.bucket = bucket
+        self.max_entries = max_entries
+        self._buckets: Dict[int, Set[bytes]] = {}
+        self._size = 0
+        self.replays = 0
+        self.evicted = 0
+
+    def _expire(self, now: int):
+        oldest = (now - self.window) // self.bucket
+        for key in [k for k in self._buckets if k < oldest]:
+            self._size -= len(self._buckets.pop(key))
+
+    def _evict_oldest(self):
+        key = min(self._buckets)
+        dropped = self._buckets.pop(key)
+        self._size -= len(dropped)
+        self.evicted += len(dropped)
+
+    @staticmethod
+    def _digest(sig: str) -> bytes:
+        try:
+            return bytes.fromhex(sig[:32])
+        except ValueError:
+            return sig[:32].encode()
+
+    async def check_and_add(self, sig: str, ts: int, now: Optional[int] = None) -> bool:
+        """签名首次出现返回 True 并记录；重复出现返回 False"""
+        now = int(time.time()) if now is None else now
+        self._expire(now)
+        digest = self._digest(sig)
+
+        key = ts // self.bucket
+        # 时间戳允许前后偏差，同一签名只可能落在同一个桶里
+        bucket = self._buckets.get(key)
+        if bucket is not None and digest in bucket:
+            self.replays += 1
+            return False
+        if bucket is None:
+            bucket = self._buckets[key] = set()
+        bucket.add(digest)
+        self._size += 1
+        while self._size > self.max_entries:
+            self._evict_oldest()
+        return True
+
+    async def discard(self, sig: str, ts: int):
+        """撤销签名记录：请求未被处理（如工作池繁忙、解密失败）时调用，允许客户端原样重试"""
+        bucket = self._buckets.get(ts // self.bucket)
+        if bucket is not None:
+            digest = self._digest(sig)
+            if digest in bucket:
+                bucket.discard(digest)
+                self._size -= 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": self._size,
+            "buckets": len(self._buckets),
+            "max_entries": self.max_entries,
+            "replays": self.replays,
+            "evicted": self.evicted,
+        }
+
+
+class CashewsReplayGuard:
+    """
+    共享后端的重放检测（多 worker / 多实例共用，如 redis://）
+    每个签名一个键，不存在时写入（SET NX），窗口前后各 window 秒后过期
+    """
+
+    def __init__(self, uri: str, window: int = 300, prefix: str = "replay"):
+        from cashews import Cache
+
+        self.window = window
+        self.prefix = prefix
+        self._cache = Cache()
+        self._cache.setup(uri)
+        self.replays = 0
+
+    async def check_and_add(self, sig: str, ts: int) -> bool:
+        """签名首次出现返回 True 并记录；重复出现返回 False"""
+        if await self._cache.set(
+            f"{self.prefix}:{sig[:32]}", 1, expire=self.window * 2, exist=False
+        ):
+            return True
+        self.replays += 1
+        return False
+
+    async def discard(self, sig: str, ts: int):
+        """撤销签名记录"""
+        await self._cache.delete(f"{self.prefix}:{sig[:32]}")
+
+    def stats(self) -> dict:
+        return {"backend": "cashews", "replays": self.replays}
+
+
+def replay_guard_from_env(window: int):
+    """
+    按环境变量创建重放检测，关闭时返回 None
+    - REPLAY_GUARD: 是否开启，默认开启
+    - REPLAY_STORE: memory（默认，仅本进程）或 cashews 后端 URI（多 worker 共享）
+    - REPLAY_CACHE_MAX: memory 模式下最多记录的签名数
+    """
+    if os.getenv("REPLAY_GUARD", "True").lower() not in ("true", "1", "t"):
+        return None
+    store = os.getenv("REPLAY_STORE", "memory")
+    if store == "memory":
+        return ReplayGuard(
+            window=window, max_entries=int(os.getenv("REPLAY_CACHE_MAX", 200_000))
+        )
+    return CashewsReplayGuard(store, window=window)
@@ -0,0 +1,45 @@
+# singleflight.py - 相同 key 的并发调用合并为一次执行
+
+import asyncio
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    同一 key 正在执行时，后到的调用不再重复执行，而是等待并共享同一结果（包括异常）
+
+    执行体以独立任务运行，发起者被取消（客户端断开）不会中断其他等待者；
+    因此执行体不应依赖发起者的请求级资源（如依赖注入的数据库会话）。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(partial(self._done, key))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        self._calls.pop(key, None)
+        # 等待者全部被取消时无人取回异常，这里取一次，避免 "Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
@@ -0,0 +1,247 @@
+# snapshot.py - 授权数据内存快照（AUTH_SNAPSHOT=true 开启）
+#
+# 启动时把 AlipayUser / Device / TgUser 载入内存哈希索引，之后按 updated_at 增量刷新，
+# 验证查询直接读内存；未命中时由 lookup 回退到缓存/数据库（新写入的行在下次增量刷新后进入快照）。
+# 删除（/da 解绑）不会改变 updated_at：机器人在删除的事务中写入变更日志 auth_change，
+# 增量刷新按 id 读取并移除对应条目，之后的查询回退到缓存/数据库。
+# 直接修改数据库（如手工封禁）时需同时更新 updated_at 或写入 auth_change，否则在下次全量重建后生效。
+
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, func, select
+
+from dbmodel import AlipayUser, Device, TgUser, get_session_local
+from shared.database import AuthChange
+from log import logger
+from refresher import Refresher, later
+
+
+class AuthSnapshot(Refresher):
+    """
+    授权数据快照
+    - tokens: token -> 支付宝账号快照（与 lookup.load_users_by_token 的行快照相同）
+    - devices: device_id -> tg_id
+    - tg_users: tg_id -> TG用户快照
+    行 id -> 键 的反向索引用于在行更新（换 token / 换设备）时移除旧键
+    变更日志（auth_change）中的键直接移除，由 lookup 回退查询
+    """
+
+    name = "授权快照"
+
+    def __init__(self, refresh_interval: float = 5, full_interval: float = 300):
+        super().__init__(refresh_interval, full_interval)
+        self.tokens: Dict[str, Dict[str, Any]] = {}
+        self.devices: Dict[str, int] = {}
+        self.tg_users: Dict[int, Dict[str, Any]] = {}
+        self._token_by_id: Dict[int, str] = {}
+        self._device_by_id: Dict[int, str] = {}
+        self._change_id = 0
+        self._prune_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refreshed_rows = 0
+        self.changes = 0
+
+    # ===== 查询 =====
+    def get_user_by_token(self, token: str) -> Optional[Dict[str, Any]]:
+        user = self.tokens.get(token)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    def get_device_owner(
+        self, device_id: str
+    ) -> Optional[tuple[Dict[str, Any], Dict[str, Any]]]:
+        """设备及其TG用户都在快照中时返回 (设备快照, TG用户快照)，否则返回 None"""
+        tg_id = self.devices.get(device_id)
+        tg_user = self.tg_users.get(tg_id) if tg_id is not None else None
+        if tg_user is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"tg_id": tg_id}, tg_user
+
+    # ===== 写入 =====
+    def put_user(self, row_id: int, token: Optional[str], user: Dict[str, Any]):
+        old = self._token_by_id.pop(row_id, None)
+        if old is not None:
+            self.tokens.pop(old, None)
+        if token:
+            self.tokens[token] = user
+            self._token_by_id[row_id] = token
+
+    def put_device(self, row_id: int, device_id: Optional[str], tg_id: int):
+        old = self._device_by_id.pop(row_id, None)
+        if old is not None:
+            self.devices.pop(old, None)
+        if device_id:
+            self.devices[device_id] = tg_id
+            self._device_by_id[row_id] = device_id
+
+    def put_tg_user(self, tg_id: int, tg_user: Dict[str, Any]):
+        self.tg_users[tg_id] = tg_user
+
+    def drop(self, changed: Dict[str, set]):
+        """移除变更日志中的键（反向索引中的旧值在行更新或全量重建时清理）"""
+        for token in changed["token"]:
+            self.tokens.pop(token, None)
+        for device_id in changed["device"]:
+            self.devices.pop(device_id, None)
+        for tg_id in changed["tg"]:
+            self.tg_users.pop(tg_id, None)
+
+    # ===== 加载 =====
+    async def load(self):
+        """
+        全量重建：在新字典中构建后整体替换，查询不会看到半成品
+        先记下变更日志位置再读行，读取期间的变更由下次增量刷新处理；
+        上次全量重建之前的变更日志（至少一个全量周期前，各进程早已读过）顺带清理
+        """
+        async with get_session_local()() as db:
+            change_id = await db.scalar(select(func.max(AuthChange.id))) or 0
+            if self._prune_id:
+                await db.execute(
+                    delete(AuthChange).where(AuthChange.id <= self._prune_id)
+                )
+                await db.commit()
+        fresh = AuthSnapshot(self.refresh_interval, self.full_interval)
+        watermark = await fresh._apply(None)
+        self.tokens, self._token_by_id = fresh.tokens, fresh._token_by_id
+        self.devices, self._device_by_id = fresh.devices, fresh._device_by_id
+        self.tg_users = fresh.tg_users
+        self._watermark = watermark
+        self._change_id = max(self._change_id, change_id)
+        self._prune_id = change_id
+        self._last_full = time.monotonic()
+        self.loaded = True
+        logger.info(
+            "授权快照已加载：[Token: {tokens} | 设备: {devices} | TG用户: {tg_users}]",
+            tokens=len(self.tokens),
+            devices=len(self.devices),
+            tg_users=len(self.tg_users),
+        )
+
+    async def refresh(self):
+        """
+        增量刷新：只读取 updated_at 不早于上次水位线（减去重叠窗口）的行；
+        再处理变更日志中新增的键：先移除，再按键重新读取，仍存在的写回最新值
+        """
+        since = self._watermark - self.overlap if self._watermark else None
+        watermark = await self._apply(since)
+        if watermark is not None and (
+            self._watermark is None or watermark > self._watermark
+        ):
+            self._watermark = watermark
+
+        changed: Dict[str, set] = {"token": set(), "device": set(), "tg": set()}
+        change_id = self._change_id
+        async with get_session_local()() as db:
+            for change_id, kind, key in await db.execute(
+                select(AuthChange.id, AuthChange.kind, AuthChange.key)
+                .where(AuthChange.id > self._change_id)
+                .order_by(AuthChange.id)
+            ):
+                if kind in changed:
+                    changed[kind].add(int(key) if kind == "tg" else key)
+                self.changes += 1
+        if change_id != self._change_id:
+            self.drop(changed)
+            await self._apply(None, changed)
+            self._change_id = change_id
+        self.refreshes += 1
+
+    async def _apply(
+        self, since: Optional[datetime], changed: Optional[Dict[str, set]] = None
+    ) -> Optional[datetime]:
+        """
+        读取行写入索引，返回其中最大的 updated_at
+        - since: 只读取 updated_at 不早于 since 的行
+        - changed: 只读取变更日志涉及的键（{"token": ..., "device": ..., "tg": ...}）
+        """
+        alipay = select(
+            AlipayUser.id,
+            AlipayUser.token,
+            AlipayUser.alipay_id,
+            AlipayUser.device_id,
+            AlipayUser.device_ban,
+            AlipayUser.account_ban,
+            AlipayUser.updated_at,
+        )
+        device = select(Device.id, Device.device_id, Device.tg_id, Device.updated_at)
+        tg_user = select(
+            TgUser.tg_id,
+            TgUser.username,
+            TgUser.first_name,
+            TgUser.last_name,
+            TgUser.updated_at,
+        )
+        if since is not None:
+            alipay = alipay.where(AlipayUser.updated_at >= since)
+            device = device.where(Device.updated_at >= since)
+            tg_user = tg_user.where(TgUser.updated_at >= since)
+        if changed is not None:
+            alipay = alipay.where(AlipayUser.token.in_(changed["token"]))
+            device = device.where(Device.device_id.in_(changed["device"]))
+            tg_user = tg_user.where(TgUser.tg_id.in_(changed["tg"]))
+
+        watermark = None
+        rows = 0
+        async with get_session_local()() as db:
+            for row in await db.execute(alipay):
+                self.put_user(
+                    row.id,
+                    row.token,
+                    {
+                        "alipay_id": row.alipay_id,
+                        "device_id": row.device_id,
+                        "device_ban": row.device_ban,
+                        "account_ban": row.account_ban,
+                    },
+                )
+                watermark = later(watermark, row.updated_at)
+                rows += 1
+            for row in await db.execute(device):
+                self.put_device(row.id, row.device_id, row.tg_id)
+                watermark = later(watermark, row.updated_at)
+                rows += 1
+            for row in await db.execute(tg_user):
+                self.put_tg_user(
+                    row.tg_id,
+                    {
+                        "username": row.username,
+                        "first_name": row.first_name,
+                        "last_name": row.last_name,
+                    },
+                )
+                watermark = later(watermark, row.updated_at)
+                rows += 1
+        self.refreshed_rows += rows
+        return watermark
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tokens": len(self.tokens),
+            "devices": len(self.devices),
+            "tg_users": len(self.tg_users),
+            "watermark": self._watermark.isoformat() if self._watermark else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refreshed_rows": self.refreshed_rows,
+            "changes": self.changes,
+            "change_id": self._change_id,
+        }
+
+
+auth_snapshot: Optional[AuthSnapshot] = None
+if os.getenv("AUTH_SNAPSHOT", "False").lower() in ("true", "1", "t"):
+    auth_snapshot = AuthSnapshot(
+        refresh_interval=float(os.getenv("AUTH_SNAPSHOT_REFRESH_INTERVAL", 5)),
+        full_interval=float(os.getenv("AUTH_SNAPSHOT_FULL_INTERVAL", 300)),
+    )
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
 
 
 # =======================
@@ -10,6 +10,31 @@ class VerifyRequest(BaseModel):
     alipay_id: Optional[str] = None
 
 
+class SecureVerifyRequest(VerifyRequest):
+    """安全验证接口解密后的请求（Token 随加密数据一起传输）"""
+
+    authorization: Optional[str] = None
+    "Bearer Token"
+
+
+MAX_VERIFY_BATCH = 20
+"批量验证的最大条目数（与机器人 /ba 的绑定上限一致）"
+
+
+class SecureVerifyBatchRequest(BaseModel):
+    """批量验证接口解密后的请求（多账号客户端一次提交全部账号）"""
+
+    items: list[SecureVerifyRequest] = Field(min_length=1, max_length=MAX_VERIFY_BATCH)
+    "待验证条目"
+
+    @property
+    def device_ids(self) -> list[str]:
+        "按设备限流时计费的设备ID（条目中出现的每个不同设备ID各计一次）"
+        return list(
+            dict.fromkeys(item.device_id for item in self.items if item.device_id)
+        )
+
+
 class VerifyResponse(BaseModel):
     """验证响应模型"""
 
@@ -23,6 +48,17 @@ class VerifyResponse(BaseModel):
     "响应数据"
 
 
+class VerifyBatchResponse(BaseModel):
+    """批量验证响应模型"""
+
+    status: int
+    "响应状态码"
+    message: str
+    "响应消息"
+    results: list[VerifyResponse]
+    "与请求条目一一对应的验证结果"
+
+
 class TokenRequest(BaseModel):
     """Token模型"""
 
@@ -35,8 +71,8 @@ class TokenRequest(BaseModel):
 class EncryptedRequest(BaseModel):
     """加密请求数据结构"""
 
-    key: str
-    "RSA加密后的AES密钥(base64)"
+    key: str = ""
+    "RSA加密后的AES密钥(base64)，携带有效 sid 时可为空"
     data: str
     "AES加密后的数据(base64)"
     iv: str
@@ -47,6 +83,12 @@ class EncryptedRequest(BaseModel):
     "时间戳(用于防重放)"
     sig: str
     "请求签名"
+    sid: Optional[str] = None
+    "会话ID（服务端此前返回的 sid，key 为空时代替 key 跳过RSA解密；携带 key 时忽略）"
+    kid: Optional[str] = None
+    "加密 key 所用公钥的 kid（/api/public_key 返回），为空时使用主密钥"
+    fmt: Literal["json", "msgpack"] = "json"
+    "加密数据的明文格式，响应使用相同格式"
 
 
 class EncryptedResponse(BaseModel):
@@ -58,3 +100,5 @@ class EncryptedResponse(BaseModel):
     "AES加密后的数据(base64)"
     tag: str
     "GCM认证标签(base64)"
+    sid: Optional[str] = None
+    "会话ID（开启会话复用时返回，后续请求可携带以跳过RSA解密）"
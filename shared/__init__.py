@@ -5,21 +5,47 @@ from .database import (
     AlipayUser,
     Device,
     TgUser,
+    AuthChange,
+    record_auth_changes,
     get_db_session,
     init_db,
+    ensure_schema,
     get_database_uri,
     get_global_engine,
     get_global_session,
+    get_pool_stats,
 )
+from .migrate import migrate_db
+from .cache import (
+    TTLCache,
+    verify_cache,
+    invalidate_tokens,
+    invalidate_devices,
+    invalidate_tg_user,
+)
+from .upsert import sync_tg_user, bind_device, bind_alipay
 
 __all__ = [
     "Base",
     "AlipayUser",
     "Device",
     "TgUser",
+    "AuthChange",
+    "record_auth_changes",
     "get_db_session",
     "init_db",
+    "ensure_schema",
     "get_database_uri",
     "get_global_engine",
     "get_global_session",
+    "get_pool_stats",
+    "migrate_db",
+    "TTLCache",
+    "verify_cache",
+    "invalidate_tokens",
+    "invalidate_devices",
+    "invalidate_tg_user",
+    "sync_tg_user",
+    "bind_device",
+    "bind_alipay",
 ]
@@ -0,0 +1,154 @@
+# src/shared/cache.py - 共享缓存模块（进程内 LRU + TTL / cashews）
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    简单的 LRU + TTL 缓存（仅在事件循环线程中使用，不加锁）
+
+    - maxsize: 最大条目数，超出时淘汰最久未使用的条目
+    - ttl: 条目存活秒数
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expire_at, value = item
+        if expire_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# ===== 验证结果缓存 =====
+MISSING = "__missing__"
+"负缓存标记：数据库中不存在该记录"
+
+
+class VerifyCache:
+    """
+    验证查询结果缓存（token / device_id / tg_id -> 数据库行快照）
+
+    由环境变量 VERIFY_CACHE_URI 决定后端：
+    - 未设置 / off: 关闭缓存
+    - local: 进程内 LRU + TTL（仅本进程可见，机器人的失效通知无法到达API服务器，
+      变更最多延迟 VERIFY_CACHE_TTL 秒生效）
+    - 其他值: 作为 cashews 后端 URI（如 redis://host:6379/0），
+      机器人与API服务器共享，失效通知立即生效
+    """
+
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        ttl: Optional[float] = None,
+        maxsize: Optional[int] = None,
+    ):
+        self.uri = uri if uri is not None else os.getenv("VERIFY_CACHE_URI", "off")
+        self.ttl = ttl or float(os.getenv("VERIFY_CACHE_TTL", 60))
+        self.enabled = self.uri not in ("", "off")
+        self._local: Optional[TTLCache] = None
+        self._cashews = None
+
+        if self.uri == "local":
+            self._local = TTLCache(
+                maxsize=maxsize or int(os.getenv("VERIFY_CACHE_MAX", 100000)),
+                ttl=self.ttl,
+            )
+        elif self.enabled:
+            from cashews import Cache
+
+            self._cashews = Cache()
+            self._cashews.setup(self.uri)
+
+    async def get(self, key: str) -> Any:
+        if self._local is not None:
+            return self._local.get(key)
+        if self._cashews is not None:
+            return await self._cashews.get(key)
+        return None
+
+    async def set(self, key: str, value: Any):
+        if self._local is not None:
+            self._local.set(key, value)
+        elif self._cashews is not None:
+            await self._cashews.set(key, value, expire=self.ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            if self._local is not None:
+                self._local.pop(key)
+            elif self._cashews is not None:
+                await self._cashews.delete(key)
+
+
+verify_cache = VerifyCache()
+
+
+def token_key(token: str) -> str:
+    return f"verify:token:{token}"
+
+
+def device_key(device_id: str) -> str:
+    return f"verify:device:{device_id}"
+
+
+def tg_user_key(tg_id: int) -> str:
+    return f"verify:tg:{tg_id}"
+
+
+# ===== 失效钩子（机器人 /bd /ba /da /sync 调用）=====
+async def invalidate_tokens(*tokens: Optional[str]):
+    await verify_cache.delete(*(token_key(t) for t in tokens if t))
+
+
+async def invalidate_devices(*device_ids: Optional[str]):
+    await verify_cache.delete(*(device_key(d) for d in device_ids if d))
+
+
+async def invalidate_tg_user(tg_id: int):
+    await verify_cache.delete(tg_user_key(tg_id))
@@ -1,11 +1,15 @@
 # src/shared/database.py - 共享数据库模块 (Async ORM)
 
 from datetime import datetime
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import DateTime, String, BigInteger, Integer, func
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy import DateTime, String, BigInteger, Integer, event, func, select
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from typing import AsyncGenerator, Optional
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import AsyncGenerator, Iterable, Optional
 import os
+import time
 from dotenv import load_dotenv
 
 
@@ -19,30 +23,59 @@ class AlipayUser(Base):
     __tablename__ = "alipay_user"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     alipay_id: Mapped[str] = mapped_column(String(255), nullable=True, unique=True)
-    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=True, index=True)
+    device_id: Mapped[Optional[str]] = mapped_column(
+        String(255), nullable=True, index=True
+    )
+    token: Mapped[Optional[str]] = mapped_column(
+        String(255), nullable=True, unique=True, index=True
+    )
+    device_ban: Mapped[int] = mapped_column(Integer, default=0)
+    account_ban: Mapped[int] = mapped_column(Integer, default=0)
     status: Mapped[int] = mapped_column(Integer, default=0)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(
         DateTime, server_default=func.now(), onupdate=func.now()
     )
 
+    tg_user: Mapped[Optional["TgUser"]] = relationship(
+        primaryjoin="foreign(AlipayUser.tg_id) == TgUser.tg_id",
+        back_populates="alipay_users",
+        viewonly=True,
+        lazy="raise",
+    )
+
 
 class Device(Base):
     __tablename__ = "device"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
-    device_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # 每个TG用户只绑定一个设备，每个设备只能被一个TG用户绑定
+    tg_id: Mapped[int] = mapped_column(
+        BigInteger, nullable=True, unique=True, index=True
+    )
+    device_id: Mapped[Optional[str]] = mapped_column(
+        String(255), nullable=True, unique=True, index=True
+    )
     status: Mapped[int] = mapped_column(Integer, default=0)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(
         DateTime, server_default=func.now(), onupdate=func.now()
     )
 
+    tg_user: Mapped[Optional["TgUser"]] = relationship(
+        primaryjoin="foreign(Device.tg_id) == TgUser.tg_id",
+        back_populates="device",
+        viewonly=True,
+        lazy="raise",
+    )
+
 
 class TgUser(Base):
     __tablename__ = "tg_user"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    tg_id: Mapped[int] = mapped_column(
+        BigInteger, nullable=True, unique=True, index=True
+    )
     token: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     username: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     first_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
@@ -53,6 +86,47 @@ class TgUser(Base):
         DateTime, server_default=func.now(), onupdate=func.now()
     )
 
+    # tg_id 并非外键，关系仅用于 JOIN 查询；lazy="raise" 避免异步环境下的隐式查询
+    device: Mapped[Optional["Device"]] = relationship(
+        primaryjoin="TgUser.tg_id == foreign(Device.tg_id)",
+        back_populates="tg_user",
+        uselist=False,
+        viewonly=True,
+        lazy="raise",
+    )
+    alipay_users: Mapped[list["AlipayUser"]] = relationship(
+        primaryjoin="TgUser.tg_id == foreign(AlipayUser.tg_id)",
+        back_populates="tg_user",
+        viewonly=True,
+        lazy="raise",
+    )
+
+
+class AuthChange(Base):
+    """
+    授权数据变更日志：删除、手工封禁等不会（或未必会）更新 updated_at 的变更，
+    开启 AUTH_SNAPSHOT 时由机器人在删除的事务中写入，API 服务器的授权快照按 id 增量读取并移除对应条目
+    """
+
+    __tablename__ = "auth_change"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(16))
+    "token / device / tg"
+    key: Mapped[str] = mapped_column(String(255))
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class SchemaMeta(Base):
+    """数据库结构版本（单行表）"""
+
+    __tablename__ = "schema_meta"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
+# 修改 ORM 模型（新增列/索引）时递增，启动时据此决定是否需要迁移
+SCHEMA_VERSION = 3
+
 
 # ===== 配置 =====
 def get_database_uri() -> str:
@@ -62,8 +136,109 @@ def get_database_uri() -> str:
     return os.getenv("DATABASE_URI", "sqlite+aiosqlite:///src/sesame.db")
 
 
+def _env_bool(name: str, default: str = "False") -> bool:
+    return os.getenv(name, default).lower() in ("true", "1", "t")
+
+
+# ===== 连接池指标 =====
+class PoolMetrics:
+    """连接池等待时间统计（借出连接时的排队耗时）"""
+
+    def __init__(self):
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds: float, timeout: bool = False):
+        self.wait_count += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        if timeout:
+            self.timeouts += 1
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """记录借出连接等待时间的连接池"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            pool_metrics.record(time.perf_counter() - start, timeout=True)
+            raise
+        pool_metrics.record(time.perf_counter() - start)
+        return conn
+
+
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(
+        f"PRAGMA busy_timeout={int(os.getenv('DB_SQLITE_BUSY_TIMEOUT', 5000))}"
+    )
+    cursor.close()
+
+
+def create_engine_from_env(database_uri: str):
+    """
+    按环境变量创建异步引擎
+
+    - DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT / DB_POOL_RECYCLE / DB_POOL_PRE_PING
+    - SQLite 文件数据库自动开启 WAL、synchronous=NORMAL 和 busy_timeout（DB_SQLITE_BUSY_TIMEOUT 毫秒）
+    """
+    url = make_url(database_uri)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    in_memory = is_sqlite and url.database in (None, "", ":memory:")
+
+    kwargs = {"echo": False, "future": True}
+    if not in_memory:
+        kwargs.update(
+            poolclass=MeteredPool,
+            pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", -1)),
+            pool_pre_ping=_env_bool("DB_POOL_PRE_PING"),
+        )
+    engine = create_async_engine(database_uri, **kwargs)
+    if is_sqlite and not in_memory:
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragma)
+    return engine
+
+
+def get_pool_stats() -> dict:
+    """连接池指标：池大小、使用中/空闲连接数、借出等待时间"""
+    pool = _engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    stats.update(
+        wait_count=pool_metrics.wait_count,
+        wait_total_ms=pool_metrics.wait_total * 1000,
+        wait_avg_ms=(
+            pool_metrics.wait_total / pool_metrics.wait_count * 1000
+            if pool_metrics.wait_count
+            else 0.0
+        ),
+        wait_max_ms=pool_metrics.wait_max * 1000,
+        timeouts=pool_metrics.timeouts,
+    )
+    return stats
+
+
 # ===== 初始化引擎和 session 工厂 =====
-_engine = create_async_engine(get_database_uri(), echo=False, future=True)
+_engine = create_engine_from_env(get_database_uri())
 AsyncSessionLocal = async_sessionmaker(
     _engine, expire_on_commit=False, class_=AsyncSession
 )
@@ -75,12 +250,58 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+# ===== 授权数据变更日志 =====
+# 只有授权快照读取变更日志，未开启 AUTH_SNAPSHOT 时不写入（机器人与API服务器读取同一个 .env）
+AUTH_CHANGE_LOG = _env_bool("AUTH_SNAPSHOT")
+
+
+def record_auth_changes(session: AsyncSession, kind: str, keys: Iterable):
+    """
+    在调用方的事务中写入变更日志，随调用方一同提交；kind 为 token / device / tg
+    行更新会刷新 updated_at，由快照的增量刷新处理，只有删除需要写入
+    """
+    if AUTH_CHANGE_LOG:
+        session.add_all(AuthChange(kind=kind, key=str(key)) for key in keys if key)
+
+
 # ===== 初始化数据库（建表）=====
 async def init_db():
     async with _engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
 
+async def get_schema_version() -> int:
+    """读取数据库结构版本，schema_meta 表不存在时返回 0"""
+    try:
+        async with _engine.connect() as conn:
+            result = await conn.execute(
+                select(SchemaMeta.version).where(SchemaMeta.id == 1)
+            )
+            return result.scalar() or 0
+    except DBAPIError:
+        return 0
+
+
+async def ensure_schema():
+    """
+    启动时调用一次：版本一致时只需一次查询；
+    版本落后时补齐表、列和索引，并记录新版本
+    绑定命令依赖的唯一键因重复数据无法创建时抛出 RuntimeError，不记录版本
+    """
+    if await get_schema_version() >= SCHEMA_VERSION:
+        return
+    from .migrate import migrate_db
+
+    missing = await migrate_db(_engine)
+    if missing:
+        raise RuntimeError(
+            f"缺少唯一约束 {missing}：请按日志清理重复数据后执行 python -m shared.migrate"
+        )
+    async with AsyncSessionLocal() as session:
+        await session.merge(SchemaMeta(id=1, version=SCHEMA_VERSION))
+        await session.commit()
+
+
 # ===== 提供全局引擎和 session 工厂 =====
 def get_global_engine():
     return _engine
@@ -0,0 +1,118 @@
+# src/shared/migrate.py - 已有数据库的结构迁移（补齐新增列与索引）
+#
+# 用法（项目根目录）：
+#   python -m shared.migrate
+#
+# create_all 只会创建缺失的表，不会修改已有表。本脚本对比 ORM 模型与
+# 数据库实际结构，补齐缺失的列和索引。唯一索引创建前会检查重复数据，
+# 存在重复时跳过该索引并输出重复值，需人工清理后重新执行。
+# 机器人绑定命令的 upsert 依赖的唯一键缺失时，migrate_db 返回缺失列表，
+# ensure_schema 据此拒绝启动（否则并发的绑定命令会写入重复行）。
+
+import asyncio
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import Connection, func, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .database import Base, get_global_engine
+
+# upsert 的冲突目标（ON CONFLICT / ON DUPLICATE KEY）：(表, 列)
+REQUIRED_UNIQUE_KEYS = (
+    ("alipay_user", "alipay_id"),
+    ("device", "tg_id"),
+    ("device", "device_id"),
+    ("tg_user", "tg_id"),
+)
+
+
+def _add_missing_columns(conn: Connection, table, existing: set[str]):
+    preparer = conn.dialect.identifier_preparer
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl = (
+            f"ALTER TABLE {preparer.format_table(table)} "
+            f"ADD COLUMN {preparer.format_column(column)} "
+            f"{column.type.compile(dialect=conn.dialect)}"
+        )
+        if column.default is not None and column.default.is_scalar:
+            ddl += f" DEFAULT {column.default.arg!r}"
+        conn.execute(text(ddl))
+        logger.info(f"新增列：{table.name}.{column.name}")
+
+
+def _find_duplicates(conn: Connection, index) -> list:
+    cols = list(index.columns)
+    stmt = (
+        select(*cols, func.count())
+        .where(*(c.isnot(None) for c in cols))
+        .group_by(*cols)
+        .having(func.count() > 1)
+        .limit(5)
+    )
+    return conn.execute(stmt).all()
+
+
+def _add_missing_indexes(conn: Connection, table, existing: set[str]):
+    for index in table.indexes:
+        if index.name in existing:
+            continue
+        if index.unique:
+            duplicates = _find_duplicates(conn, index)
+            if duplicates:
+                logger.warning(
+                    f"跳过唯一索引 {index.name}：存在重复数据 {duplicates}，请清理后重试"
+                )
+                continue
+        index.create(conn)
+        logger.info(f"新增索引：{index.name}")
+
+
+def _missing_unique_keys(conn: Connection) -> list[str]:
+    inspector = inspect(conn)
+    missing = []
+    for table_name, column in REQUIRED_UNIQUE_KEYS:
+        keys = {
+            tuple(i["column_names"])
+            for i in inspector.get_indexes(table_name)
+            if i.get("unique")
+        }
+        keys |= {
+            tuple(c["column_names"])
+            for c in inspector.get_unique_constraints(table_name)
+        }
+        if (column,) not in keys:
+            missing.append(f"{table_name}.{column}")
+    return missing
+
+
+def _migrate(conn: Connection) -> list[str]:
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            table.create(conn)
+            logger.info(f"新增表：{table.name}")
+            continue
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        _add_missing_columns(conn, table, columns)
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        _add_missing_indexes(conn, table, indexes)
+
+    missing = _missing_unique_keys(conn)
+    if missing:
+        logger.error(f"缺少唯一约束：{missing}，绑定命令无法防止重复数据")
+    return missing
+
+
+async def migrate_db(engine: Optional[AsyncEngine] = None) -> list[str]:
+    """对比模型与数据库结构，补齐缺失的表、列和索引，返回仍缺失的必需唯一键"""
+    engine = engine or get_global_engine()
+    async with engine.begin() as conn:
+        return await conn.run_sync(_migrate)
+
+
+if __name__ == "__main__":
+    if asyncio.run(migrate_db()):
+        raise SystemExit(1)
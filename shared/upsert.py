@@ -0,0 +1,245 @@
+# src/shared/upsert.py - 机器人绑定命令的单语句写入（按方言生成 upsert）
+#
+# SQLite / PostgreSQL: INSERT ... ON CONFLICT ... RETURNING，一次往返得到结果
+# MySQL: INSERT ... ON DUPLICATE KEY UPDATE / INSERT IGNORE，结果由受影响行数与
+#        LAST_INSERT_ID 判断（没有 RETURNING，部分结果需要按唯一键再读一次）
+#        命中已有行且无变化时，受影响行数在 CLIENT_FOUND_ROWS 下为 1（SQLAlchemy 的
+#        MySQL 方言默认开启）、关闭时为 0；下面只区分“是否为 2（有变化）”，两种设置结果相同
+# 并发的重复命令由唯一约束兜底，不会产生重复行（唯一约束缺失时 ensure_schema 拒绝启动）
+
+import asyncio
+from typing import Optional
+from weakref import WeakValueDictionary
+
+from sqlalchemy import and_, func, literal, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import AlipayUser, Device, TgUser
+
+MAX_ALIPAY_PER_USER = 20
+"每个TG用户最多绑定的支付宝账号数"
+
+# 写入结果
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+TAKEN = "taken"
+"唯一键已被其他TG用户占用"
+LIMITED = "limited"
+"绑定数量已达上限"
+
+
+# /ba 按TG用户串行：INSERT ... SELECT COUNT 在 READ COMMITTED 等隔离级别下，
+# 同一用户的并发命令可能都看到 19 条而同时写入；锁在进程内，覆盖单个机器人进程
+_alipay_locks: "WeakValueDictionary[int, asyncio.Lock]" = WeakValueDictionary()
+
+
+def _dialect(session: AsyncSession) -> str:
+    return session.bind.dialect.name
+
+
+def _insert(dialect: str):
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _mysql_existed(model) -> tuple:
+    """
+    MySQL 更新分支的标记列：id = id + LAST_INSERT_ID(0)
+    值不变，但命中已有行时 LAST_INSERT_ID 被置 0，插入时为新行 id，据此区分新建/已存在
+    """
+    return ("id", model.id + func.last_insert_id(0))
+
+
+async def sync_tg_user(
+    session: AsyncSession,
+    tg_id: int,
+    token: str,
+    username: str,
+    first_name: str,
+    last_name: str,
+) -> tuple[str, Optional[str]]:
+    """
+    /sync：注册TG用户或更新昵称，已有 token 时保留原 token
+
+    返回 (结果, 当前 token)：
+    - CREATED: 新用户，或旧用户此前没有 token，本次写入了传入的 token
+    - UPDATED: 昵称有变化
+    - UNCHANGED: 无变化（SQLite / PostgreSQL 下 token 为 None）
+    """
+    dialect = _dialect(session)
+    stmt = _insert(dialect)(TgUser).values(
+        tg_id=tg_id,
+        token=token,
+        username=username,
+        first_name=first_name,
+        last_name=last_name,
+    )
+
+    if dialect == "mysql":
+        new = stmt.inserted
+        changed = or_(
+            TgUser.token.is_(None),
+            TgUser.username.is_distinct_from(new.username),
+            TgUser.first_name.is_distinct_from(new.first_name),
+            TgUser.last_name.is_distinct_from(new.last_name),
+        )
+        # 按顺序赋值：updated_at 需在其它列被覆盖前比较旧值
+        stmt = stmt.on_duplicate_key_update(
+            [
+                _mysql_existed(TgUser),
+                ("updated_at", func.if_(changed, func.now(), TgUser.updated_at)),
+                ("token", func.coalesce(TgUser.token, new.token)),
+                ("username", new.username),
+                ("first_name", new.first_name),
+                ("last_name", new.last_name),
+            ]
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        if result.lastrowid:
+            return CREATED, token
+        # 受影响行数：插入 1，有变化 2，无变化 1 或 0（见文件头）
+        if result.rowcount != 2:
+            return UNCHANGED, None
+        current = await session.scalar(
+            select(TgUser.token).where(TgUser.tg_id == tg_id)
+        )
+        return (CREATED if current == token else UPDATED), current
+
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TgUser.tg_id],
+        set_={
+            "token": func.coalesce(TgUser.token, excluded.token),
+            "username": excluded.username,
+            "first_name": excluded.first_name,
+            "last_name": excluded.last_name,
+            "updated_at": func.now(),
+        },
+        where=or_(
+            TgUser.token.is_(None),
+            TgUser.username.is_distinct_from(excluded.username),
+            TgUser.first_name.is_distinct_from(excluded.first_name),
+            TgUser.last_name.is_distinct_from(excluded.last_name),
+        ),
+    ).returning(TgUser.token)
+    current = (await session.execute(stmt)).scalar_one_or_none()
+    await session.commit()
+    if current is None:
+        return UNCHANGED, None
+    return (CREATED if current == token else UPDATED), current
+
+
+async def bind_device(session: AsyncSession, tg_id: int, device_id: str) -> str:
+    """
+    /bd：绑定或更换 Verify ID（tg_id、device_id 均唯一）
+
+    返回 CREATED / UPDATED / UNCHANGED / TAKEN（已被他人绑定）
+    """
+    dialect = _dialect(session)
+    stmt = _insert(dialect)(Device).values(tg_id=tg_id, device_id=device_id)
+
+    if dialect == "mysql":
+        # 任一唯一键冲突都会进入更新分支，只在冲突行属于本人时改写 device_id；
+        # 本人已有其它设备且目标设备属于他人时，改写会触发 device_id 唯一约束
+        new = stmt.inserted
+        own = Device.tg_id == new.tg_id
+        stmt = stmt.on_duplicate_key_update(
+            [
+                _mysql_existed(Device),
+                (
+                    "updated_at",
+                    func.if_(
+                        and_(own, Device.device_id.is_distinct_from(new.device_id)),
+                        func.now(),
+                        Device.updated_at,
+                    ),
+                ),
+                ("device_id", func.if_(own, new.device_id, Device.device_id)),
+            ]
+        )
+        try:
+            result = await session.execute(stmt)
+        except IntegrityError:
+            await session.rollback()
+            return TAKEN
+        await session.commit()
+        if result.lastrowid:
+            return CREATED
+        if result.rowcount == 2:
+            return UPDATED
+        owner = await session.scalar(
+            select(Device.tg_id).where(Device.device_id == device_id)
+        )
+        return UNCHANGED if owner == tg_id else TAKEN
+
+    excluded = stmt.excluded
+    # 新插入的行 created_at == updated_at；同一秒内先绑定再更换会被判为新建，仅影响提示文案
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Device.tg_id],
+        set_={"device_id": excluded.device_id, "updated_at": func.now()},
+        where=Device.device_id.is_distinct_from(excluded.device_id),
+    ).returning(Device.created_at == Device.updated_at)
+    try:
+        created = (await session.execute(stmt)).scalar_one_or_none()
+    except IntegrityError:
+        # device_id 冲突不在 ON CONFLICT 目标内，由唯一约束报错
+        await session.rollback()
+        return TAKEN
+    await session.commit()
+    if created is None:
+        return UNCHANGED
+    return CREATED if created else UPDATED
+
+
+async def bind_alipay(session: AsyncSession, tg_id: int, alipay_id: str) -> str:
+    """
+    /ba：绑定支付宝账号，每个TG用户最多 MAX_ALIPAY_PER_USER 个
+
+    数量检查与插入在同一条 INSERT ... SELECT 中完成，alipay_id 冲突时不写入；
+    同一TG用户的命令在进程内串行执行，并发提交不会超出上限
+    返回 CREATED / UNCHANGED（本人已绑定）/ TAKEN / LIMITED
+    未写入时再按 alipay_id 读一次以区分原因
+    """
+    lock = _alipay_locks.get(tg_id)
+    if lock is None:
+        lock = _alipay_locks[tg_id] = asyncio.Lock()
+    async with lock:
+        return await _bind_alipay(session, tg_id, alipay_id)
+
+
+async def _bind_alipay(session: AsyncSession, tg_id: int, alipay_id: str) -> str:
+    dialect = _dialect(session)
+    count = (
+        select(func.count())
+        .select_from(AlipayUser)
+        .where(AlipayUser.tg_id == tg_id)
+        .scalar_subquery()
+    )
+    rows = select(literal(alipay_id), literal(tg_id)).where(count < MAX_ALIPAY_PER_USER)
+    stmt = _insert(dialect)(AlipayUser).from_select(
+        [AlipayUser.alipay_id, AlipayUser.tg_id], rows
+    )
+    if dialect == "mysql":
+        stmt = stmt.prefix_with("IGNORE")
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[AlipayUser.alipay_id])
+
+    result = await session.execute(stmt)
+    await session.commit()
+    if result.rowcount:
+        return CREATED
+
+    owner = await session.scalar(
+        select(AlipayUser.tg_id).where(AlipayUser.alipay_id == alipay_id)
+    )
+    if owner is None:
+        return LIMITED
+    return UNCHANGED if owner == tg_id else TAKEN
@@ -13,10 +13,15 @@ from .config import Config
 from .database import (
     AlipayUser,
     Device,
-    TgUser,
-    init_db,
+    ensure_schema,
     AsyncSessionLocal,
     AsyncGenerator,
+    verify_cache,
+    invalidate_devices,
+    invalidate_tg_user,
+    invalidate_tokens,
+    record_auth_changes,
+    upsert,
 )
 from .msg import guide_msg
 
@@ -25,7 +30,6 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from nonebot.params import Depends
 
-
 __author__ = "byseven"
 __plugin_meta__ = PluginMetadata(
     name="sesame",
@@ -34,7 +38,8 @@ __plugin_meta__ = PluginMetadata(
     type="application",
     config=Config,
 )
-c = get_driver().config
+driver = get_driver()
+c = driver.config
 config = get_plugin_config(Config)
 
 logger.info(f"{c.database_uri}")
@@ -49,8 +54,13 @@ da_cmd = on_command("da", rule=to_me(), priority=5)
 auto_leave = on_message(priority=10, block=False)
 
 
+@driver.on_startup
+async def _():
+    # 仅在启动时检查一次数据库结构版本，命令处理时不再建表
+    await ensure_schema()
+
+
 async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
-    await init_db()
     async with AsyncSessionLocal() as session:
         yield session
 
@@ -87,42 +97,17 @@ async def _(
     _first_name = event.chat.first_name or ""
     _last_name = event.chat.last_name or ""
 
-    # 查询用户
-    result = await db.execute(select(TgUser).where(TgUser.tg_id == tg_id))
-    user = result.scalar_one_or_none()
-
-    if user:
-        updated_fields = {}
-        if not user.token:
-            user.token = tk
-            updated_fields["token"] = tk
-        if user.username != _username:
-            user.username = _username
-            updated_fields["username"] = _username
-        if user.first_name != _first_name:
-            user.first_name = _first_name
-            updated_fields["first_name"] = _first_name
-        if user.last_name != _last_name:
-            user.last_name = _last_name
-            updated_fields["last_name"] = _last_name
-
-        if updated_fields:
-            await db.commit()
-            await bu_cmd.finish(f"生成授权成功 🔑 请妥善保管授权 {user.token}")
-        else:
-            await bu_cmd.finish("无需更新，信息未发生变化 ✅")
-    else:
-        user = TgUser(
-            tg_id=tg_id,
-            token=tk,
-            username=_username,
-            first_name=_first_name,
-            last_name=_last_name,
-        )
-        db.add(user)
-        await db.commit()
-        await db.refresh(user)
-        await bu_cmd.finish(f"注册成功 🔑 请妥善保管授权 {user.token}")
+    # 单条 upsert：不存在则注册，存在则更新昵称并保留已有 token
+    outcome, token = await upsert.sync_tg_user(
+        db, tg_id, tk, _username, _first_name, _last_name
+    )
+    if outcome == upsert.UNCHANGED:
+        await bu_cmd.finish("无需更新，信息未发生变化 ✅")
+
+    await invalidate_tg_user(tg_id)
+    if outcome == upsert.CREATED:
+        await bu_cmd.finish(f"注册成功 🔑 请妥善保管授权 {token}")
+    await bu_cmd.finish(f"生成授权成功 🔑 请妥善保管授权 {token}")
 
 
 # 绑定 Verify ID
@@ -145,32 +130,28 @@ async def _(
             "❌ 格式错误：应为32位长度的 Verify ID，请在模块主页长按复制"
         )
 
-    # 检查是否已有这个 device_id 被其他人绑定
-    result = await db.execute(select(Device).where(Device.device_id == target_msg))
-    existing = result.scalars().first()
-    if existing and existing.tg_id != event.chat.id:
+    # 旧 Verify ID 仅用于缓存失效，缓存关闭时不必多查一次
+    old_device_id = None
+    if verify_cache.enabled:
+        old_device_id = await db.scalar(
+            select(Device.device_id).where(Device.tg_id == event.chat.id)
+        )
+
+    # 单条 upsert：唯一约束保证同一 Verify ID 不会被重复绑定
+    outcome = await upsert.bind_device(db, event.chat.id, target_msg)
+    if outcome == upsert.TAKEN:
         await bd_cmd.finish("⚠️ 此 Verify ID 已被他人绑定，无法重复使用")
+    if outcome == upsert.UNCHANGED:
+        await bd_cmd.finish("✅ 你已绑定该 Verify ID，无需重复提交")
 
-    # 当前用户是否已有记录
-    result = await db.execute(select(Device).where(Device.tg_id == event.chat.id))
-    device = result.scalars().first()
-
-    if device:
-        if device.device_id == target_msg:
-            await bd_cmd.finish("✅ 你已绑定该 Verify ID，无需重复提交")
-        else:
-            device.device_id = target_msg
-            await db.commit()
-            await bd_cmd.finish(
-                f"📱更新 Verify ID 成功：{target_msg[:4]}********{target_msg[-4:]}"
-            )
-    else:
-        new_device = Device(device_id=target_msg, tg_id=event.chat.id)
-        db.add(new_device)
-        await db.commit()
+    await invalidate_devices(old_device_id, target_msg)
+    if outcome == upsert.UPDATED:
         await bd_cmd.finish(
-            f"📱Verify ID 绑定成功：{target_msg[:4]}********{target_msg[-4:]}"
+            f"📱更新 Verify ID 成功：{target_msg[:4]}********{target_msg[-4:]}"
         )
+    await bd_cmd.finish(
+        f"📱Verify ID 绑定成功：{target_msg[:4]}********{target_msg[-4:]}"
+    )
 
 
 # 绑定 alipay userId
@@ -189,31 +170,14 @@ async def _(
         if len(target_msg) != 16 or not target_msg.isdigit():
             await ba_cmd.finish("请检查输入的格式是否正确：必须是16位数字ID")
 
-        # 检查该 alipay_id 是否已经被绑定
-        result = await db.execute(
-            select(AlipayUser).where(AlipayUser.alipay_id == target_msg)
-        )
-        existing = result.scalars().first()
-
-        if existing:
-            if existing.tg_id == event.chat.id:
-                await ba_cmd.finish("你已绑定该账号，请勿重复绑定")
-            else:
-                await ba_cmd.finish("该ID已经被其他用户绑定")
-
-        # 检查该 Telegram 用户绑定了几个账号
-        result = await db.execute(
-            select(AlipayUser).where(AlipayUser.tg_id == event.chat.id)
-        )
-        count = len(result.scalars().all())
-        if count >= 20:
+        # 数量检查与插入在同一条语句中完成，并发重复提交只会写入一行
+        outcome = await upsert.bind_alipay(db, event.chat.id, target_msg)
+        if outcome == upsert.UNCHANGED:
+            await ba_cmd.finish("你已绑定该账号，请勿重复绑定")
+        if outcome == upsert.TAKEN:
+            await ba_cmd.finish("该ID已经被其他用户绑定")
+        if outcome == upsert.LIMITED:
             await ba_cmd.finish("别鸡巴绑了这么多个账号了💢")
-
-        # 插入新记录
-        alipay = AlipayUser(alipay_id=target_msg, tg_id=event.chat.id)
-        db.add(alipay)
-        await db.commit()
-        await db.refresh(alipay)
         await ba_cmd.finish(f"账号绑定成功 {target_msg[:3]}********{target_msg[-3:]}")
 
 
@@ -245,6 +209,9 @@ async def _(
     if not alipay_user:
         await da_cmd.finish(f"你并没有绑定: {target_msg}")
 
+    token = alipay_user.token
     await db.delete(alipay_user)
+    record_auth_changes(db, "token", (token,))
     await db.commit()
+    await invalidate_tokens(token)
     await da_cmd.finish(f"成功解绑: {target_msg[:3]}********{target_msg[-3:]}")
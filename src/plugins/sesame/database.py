@@ -17,10 +17,19 @@ from shared.database import (
     AsyncSession,
     get_db_session as shared_get_db_session,
     init_db as shared_init_db,
+    ensure_schema,
     get_database_uri,
     get_global_engine,
     get_global_session,
+    record_auth_changes,
 )
+from shared.cache import (
+    verify_cache,
+    invalidate_devices,
+    invalidate_tg_user,
+    invalidate_tokens,
+)
+from shared import upsert
 
 DATABASE_URI = get_database_uri()
 